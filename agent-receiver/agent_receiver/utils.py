@@ -3,8 +3,13 @@
 # This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
 # conditions defined in the file COPYING, which is part of this source code package.
 
+import base64
+import functools
 import json
 import os
+import time
+from collections import OrderedDict
+from collections.abc import Iterator, Sequence
 from pathlib import Path
 from uuid import UUID
 
@@ -16,26 +21,48 @@ from cryptography.x509.oid import NameOID
 
 class Host:
     def __init__(self, uuid: UUID) -> None:
-        self._source_path = agent_output_dir() / str(uuid)
+        source_path = agent_output_dir() / str(uuid)
+        self._set_link_data(source_path, self._read_link(source_path))
 
-        self._registered = self.source_path.is_symlink()
-        target_path = self._get_target_path() if self.registered else None
+    @classmethod
+    def iter_all(cls) -> Iterator["Host"]:
+        """Create a Host for each entry of the agent output directory
 
-        self._hostname = target_path.name if target_path else None
-        self._host_type = self._get_host_type(target_path)
+        The directory entries already tell which of them are symlinks, so only those are read.
+        """
+        with os.scandir(agent_output_dir()) as entries:
+            for entry in entries:
+                host = cls.__new__(cls)
+                host._set_link_data(
+                    Path(entry.path),
+                    cls._read_link(entry.path) if entry.is_symlink() else None,
+                )
+                yield host
 
-    def _get_target_path(self) -> Path | None:
+    @staticmethod
+    def _read_link(path: str | Path) -> str | None:
         try:
-            return Path(os.readlink(self.source_path))
-        except (FileNotFoundError, OSError):
+            return os.readlink(path)
+        except OSError:
+            # not a symlink or not existing at all
             return None
 
+    def _set_link_data(self, source_path: Path, target: str | None) -> None:
+        self._source_path = source_path
+        self._registered = target is not None
+        self._hostname = os.path.basename(target) if target else None
+        self._host_type = self._get_host_type(target)
+
     @staticmethod
-    def _get_host_type(target_path: Path | None) -> HostTypeEnum | None:
-        if not target_path:
+    def _get_host_type(target: str | None) -> HostTypeEnum | None:
+        if not target:
             return None
 
-        return HostTypeEnum.PUSH if target_path.exists() else HostTypeEnum.PULL
+        try:
+            os.stat(target)
+        except OSError:
+            return HostTypeEnum.PULL
+        return HostTypeEnum.PUSH
 
     @property
     def source_path(self) -> Path:
@@ -56,37 +83,173 @@ class Host:
 
 def read_rejection_notice_from_file(path: Path) -> str | None:
     try:
-        registration_request = json.loads(path.read_text())
+        registration_request = json.loads(path.read_bytes())
     except FileNotFoundError:
         return None
 
-    return registration_request.get("state", {}).get("readable")
+    if (state := registration_request.get("state")) is None:
+        return None
+    return state.get("readable")
+
+
+_ACCESS_TIME_UPDATE_INTERVAL = 60.0
+_MAX_CACHED_ACCESS_TIMES = 10000
+_last_access_time_updates: OrderedDict[Path, float] = OrderedDict()
 
 
 def update_file_access_time(path: Path) -> None:
+    # The access time is only used to detect abandoned registration requests, refreshing it once
+    # a minute is enough for files which are polled frequently.
+    now = time.monotonic()
+    if (
+        last_update := _last_access_time_updates.get(path)
+    ) is not None and now - last_update < _ACCESS_TIME_UPDATE_INTERVAL:
+        return
+
     try:
         os.utime(path, None)
     except OSError:
-        pass
+        return
+
+    _last_access_time_updates[path] = now
+    _last_access_time_updates.move_to_end(path)
+    if len(_last_access_time_updates) > _MAX_CACHED_ACCESS_TIMES:
+        _last_access_time_updates.popitem(last=False)
+
+
+@functools.lru_cache
+def _registration_status_dirs() -> Sequence[tuple[RegistrationStatusEnum, str]]:
+    return tuple((status, str(r4r_dir() / status.name)) for status in RegistrationStatusEnum)
+
+
+class _RegistrationStatusIndex:
+    """Maps registration request file names to the status directory they were last seen in
+
+    The index is rebuilt from one directory scan per status once it is older than max_age. It
+    may be outdated, so it only serves as a hint which status directory to look at first.
+    """
+
+    def __init__(self, max_age: float) -> None:
+        self._max_age = max_age
+        self._index: dict[str, RegistrationStatusEnum] = {}
+        self._built_at: float | None = None
+
+    def lookup(self, file_name: str) -> RegistrationStatusEnum | None:
+        now = time.monotonic()
+        if self._built_at is None or now - self._built_at > self._max_age:
+            self._index = self._build()
+            self._built_at = now
+        return self._index.get(file_name)
+
+    @staticmethod
+    def _build() -> dict[str, RegistrationStatusEnum]:
+        index: dict[str, RegistrationStatusEnum] = {}
+        for status, status_dir in _registration_status_dirs():
+            try:
+                with os.scandir(status_dir) as entries:
+                    index.update((entry.name, status) for entry in entries)
+            except OSError:
+                continue
+        return index
+
+
+_registration_status_index = _RegistrationStatusIndex(max_age=10.0)
 
 
 def get_registration_status_from_file(uuid: UUID) -> RegistrationData | None:
-    for status in RegistrationStatusEnum:
-        path = r4r_dir() / status.name / f"{uuid}.json"
-        if path.exists():
-            message = (
-                read_rejection_notice_from_file(path)
-                if status is RegistrationStatusEnum.DECLINED
-                else None
-            )
-            # access time is used to determine when to remove registration request file
-            update_file_access_time(path)
-            return RegistrationData(status=status, message=message)
+    file_name = f"{uuid}.json"
+    status_dirs = _registration_status_dirs()
+    if (indexed_status := _registration_status_index.lookup(file_name)) is not None:
+        # check the status we have seen last first, usually that's the only lookup needed
+        status_dirs = sorted(
+            status_dirs, key=lambda status_dir: status_dir[0] is not indexed_status
+        )
+
+    for status, status_dir in status_dirs:
+        path_str = os.path.join(status_dir, file_name)
+        try:
+            os.stat(path_str)
+        except OSError:
+            continue
+
+        path = Path(path_str)
+        message = (
+            read_rejection_notice_from_file(path)
+            if status is RegistrationStatusEnum.DECLINED
+            else None
+        )
+        # access time is used to determine when to remove registration request file
+        update_file_access_time(path)
+        return RegistrationData(status=status, message=message)
 
     return None
 
 
+_DER_TAG_SEQUENCE = 0x30
+_DER_TAG_SET = 0x31
+_DER_TAG_OID = 0x06
+_DER_STRING_TAGS = frozenset((0x0C, 0x13))  # UTF8String, PrintableString
+_DER_OID_COMMON_NAME = b"\x55\x04\x03"  # 2.5.4.3
+
+
+def _der_element(der: bytes, offset: int, expected_tag: int | None = None) -> tuple[int, int, int]:
+    """Return tag, start and end of the contents of the DER element at offset"""
+    tag = der[offset]
+    if expected_tag is not None and tag != expected_tag:
+        raise ValueError(f"unexpected DER tag {tag:#x}")
+    length = der[offset + 1]
+    start = offset + 2
+    if length & 0x80:
+        num_length_bytes = length & 0x7F
+        length = int.from_bytes(der[start : start + num_length_bytes], "big")
+        start += num_length_bytes
+    if (end := start + length) > len(der):
+        raise ValueError("truncated DER element")
+    return tag, start, end
+
+
+def _common_name_from_der_csr(der: bytes) -> str:
+    """Extract the subject CN by walking CertificationRequest -> CertificationRequestInfo -> Name
+
+    Only the subject is looked at, the rest of the CSR (key, attributes, signature) is skipped.
+    """
+    _tag, cr_start, _cr_end = _der_element(der, 0, _DER_TAG_SEQUENCE)
+    _tag, cri_start, _cri_end = _der_element(der, cr_start, _DER_TAG_SEQUENCE)
+    _tag, _version_start, version_end = _der_element(der, cri_start)
+    _tag, rdn_offset, name_end = _der_element(der, version_end, _DER_TAG_SEQUENCE)
+
+    while rdn_offset < name_end:
+        _tag, attribute_offset, rdn_end = _der_element(der, rdn_offset, _DER_TAG_SET)
+        while attribute_offset < rdn_end:
+            _tag, oid_offset, attribute_end = _der_element(der, attribute_offset, _DER_TAG_SEQUENCE)
+            _tag, oid_start, oid_end = _der_element(der, oid_offset, _DER_TAG_OID)
+            if der[oid_start:oid_end] == _DER_OID_COMMON_NAME:
+                tag, value_start, value_end = _der_element(der, oid_end)
+                if tag not in _DER_STRING_TAGS:
+                    raise ValueError(f"unexpected CN string type {tag:#x}")
+                return der[value_start:value_end].decode("utf-8")
+            attribute_offset = attribute_end
+        rdn_offset = rdn_end
+
+    raise ValueError("no CN in CSR subject")
+
+
+def _der_from_pem(pem: str) -> bytes:
+    return base64.b64decode(
+        "".join(line for line in pem.strip().splitlines() if not line.startswith("-----")),
+        validate=True,
+    )
+
+
+# agents may retry the pairing with the same CSR, don't parse it again
+@functools.lru_cache(maxsize=1024)
 def uuid_from_pem_csr(pem_csr: str) -> str:
+    try:
+        return _common_name_from_der_csr(_der_from_pem(pem_csr))
+    except (ValueError, IndexError):
+        # fall back to the full parser, which also copes with anything unusual
+        pass
+
     try:
         return (
             load_pem_x509_csr(pem_csr.encode())
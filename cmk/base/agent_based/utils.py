@@ -32,15 +32,15 @@ def get_section_kwargs(
         else ["section_%s" % s for s in parsed_section_names]
     )
 
-    kwargs = {
-        key: parsed_sections_broker.get_parsed_section(host_key, parsed_section_name)
-        for key, parsed_section_name in zip(keys, parsed_section_names)
-    }
-    # empty it, if nothing was found:
-    if all(v is None for v in kwargs.values()):
-        return {}
+    kwargs: dict[str, ParsedSectionContent] = {}
+    found_any = False
+    for key, parsed_section_name in zip(keys, parsed_section_names):
+        section = parsed_sections_broker.get_parsed_section(host_key, parsed_section_name)
+        kwargs[key] = section
+        found_any |= section is not None
 
-    return kwargs
+    # empty it, if nothing was found:
+    return kwargs if found_any else {}
 
 
 def get_section_cluster_kwargs(
@@ -55,12 +55,11 @@ def get_section_cluster_kwargs(
     """
     kwargs: dict[str, dict[str, ParsedSectionContent]] = {}
     for node_key in node_keys:
+        # get_section_kwargs is empty for nodes without any data, so kwargs stays empty
+        # if nothing was found at all.
         node_kwargs = get_section_kwargs(parsed_sections_broker, node_key, parsed_section_names)
         for key, sections_node_data in node_kwargs.items():
             kwargs.setdefault(key, {})[node_key.hostname] = sections_node_data
-    # empty it, if nothing was found:
-    if all(v is None for s in kwargs.values() for v in s.values()):
-        return {}
 
     return kwargs
 
@@ -85,24 +84,13 @@ def summarize_host_sections(
             fetcher_type=source.fetcher_type,
         )
         if include_ok_results or any(s.state != 0 for s in subresults):
-            yield from (
-                ActiveCheckResult(
-                    s.state if override_non_ok_state is None else override_non_ok_state,
-                    f"[{source.ident}] {s.summary}",
-                    s.details,
-                    s.metrics,
-                )
-                for s in subresults[:1]
-            )
-            yield from (
-                ActiveCheckResult(
-                    s.state if override_non_ok_state is None else override_non_ok_state,
-                    s.summary,
-                    s.details,
-                    s.metrics,
+            for idx, subresult in enumerate(subresults):
+                yield ActiveCheckResult(
+                    subresult.state if override_non_ok_state is None else override_non_ok_state,
+                    f"[{source.ident}] {subresult.summary}" if idx == 0 else subresult.summary,
+                    subresult.details,
+                    subresult.metrics,
                 )
-                for s in subresults[1:]
-            )
 
 
 def check_parsing_errors(
@@ -110,5 +98,6 @@ def check_parsing_errors(
     *,
     error_state: ServiceState = 1,
 ) -> Sequence[ActiveCheckResult]:
-    state = error_state if errors else 0
-    return [ActiveCheckResult(state, msg.split(" - ")[0], (msg,)) for msg in errors]
+    if not errors:
+        return ()
+    return [ActiveCheckResult(error_state, msg.partition(" - ")[0], (msg,)) for msg in errors]
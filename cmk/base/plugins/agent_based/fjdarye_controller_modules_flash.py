@@ -14,7 +14,9 @@
 # <oid>.3: Status
 # the latter can be one of the following:
 
-from .agent_based_api.v1 import any_of, equals, register, SNMPTree
+import re
+
+from .agent_based_api.v1 import matches, register, SNMPTree
 from .utils.fjdarye import check_fjdarye_item, discover_fjdarye_item, parse_fjdarye_item
 
 FJDARYE_SUPPORTED_DEVICES = [
@@ -31,8 +33,9 @@ register.snmp_section(
         SNMPTree(base=f"{device_oid}.2.4.2.1", oids=["1", "3"])
         for device_oid in FJDARYE_SUPPORTED_DEVICES
     ],
-    detect=any_of(
-        *[equals(".1.3.6.1.2.1.1.2.0", device_oid) for device_oid in FJDARYE_SUPPORTED_DEVICES]
+    detect=matches(
+        ".1.3.6.1.2.1.1.2.0",
+        "|".join(re.escape(device_oid) for device_oid in FJDARYE_SUPPORTED_DEVICES),
     ),
 )
 
@@ -3,37 +3,54 @@
 # This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
 # conditions defined in the file COPYING, which is part of this source code package.
 
+import functools
 import json
-from typing import Any, Callable, Iterable, Mapping, NamedTuple, Sequence
+import sys
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Mapping, Sequence
 
 from ..agent_based_api.v1 import check_levels, IgnoreResultsError, render, Service
 from ..agent_based_api.v1.type_defs import CheckResult, DiscoveryResult, StringTable
 
 AZURE_AGENT_SEPARATOR = "|"
 
+_SPACE_TO_UNDERSCORE = str.maketrans(" ", "_")
 
-class AzureMetric(NamedTuple):
+
+@dataclass(frozen=True, slots=True)
+class AzureMetric:
     name: str
     aggregation: str
     value: float
     unit: str
 
 
-class Resource(NamedTuple):
+@dataclass(frozen=True, slots=True)
+class Resource:
     id: str
     name: str
     type: str
     group: str
     kind: str | None = None
     location: str | None = None
-    tags: Mapping[str, str] = {}
-    properties: Mapping[str, str | int] = {}
-    specific_info: Mapping[str, str | int] = {}
-    metrics: Mapping[str, AzureMetric] = {}
+    tags: Mapping[str, str] = field(default_factory=dict)
+    properties: Mapping[str, str | int] = field(default_factory=dict)
+    specific_info: Mapping[str, str | int] = field(default_factory=dict)
+    metrics: Mapping[str, AzureMetric] = field(default_factory=dict)
     subscription: str | None = None
+    public_tags: Sequence[tuple[str, str]] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        # the tags are reported by every check of the resource, sort them only once
+        object.__setattr__(
+            self,
+            "public_tags",
+            sorted((k, v) for k, v in self.tags.items() if not k.startswith("hidden-")),
+        )
 
 
-class MetricData(NamedTuple):
+@dataclass(frozen=True, slots=True)
+class MetricData:
     azure_metric_name: str
     metric_name: str
     metric_label: str
@@ -65,32 +82,43 @@ def _get_metrics_number(row: Sequence[str]) -> int:
         return 0
 
 
-def _get_metrics(metrics_data: Sequence[Sequence[str]]) -> Iterable[tuple[str, AzureMetric]]:
+@functools.lru_cache
+def _metric_key(aggregation: str, name: str) -> str:
+    # the same few metric names show up for every resource, share the key objects
+    return sys.intern(f"{aggregation}_{name.translate(_SPACE_TO_UNDERSCORE)}")
+
+
+def _get_metrics(metrics_data: Sequence[Sequence[str]]) -> Mapping[str, AzureMetric]:
+    metrics = {}
     for metric_line in metrics_data:
-        metric_dict = json.loads(AZURE_AGENT_SEPARATOR.join(metric_line))
+        metric_dict = json.loads(
+            metric_line[0] if len(metric_line) == 1 else AZURE_AGENT_SEPARATOR.join(metric_line)
+        )
 
-        key = f"{metric_dict['aggregation']}_{metric_dict['name'].replace(' ', '_')}"
-        yield key, AzureMetric(
-            metric_dict["name"],
-            metric_dict["aggregation"],
+        name = metric_dict["name"]
+        aggregation = metric_dict["aggregation"]
+        metrics[_metric_key(aggregation, name)] = AzureMetric(
+            name,
+            aggregation,
             metric_dict["value"],
             metric_dict["unit"],
         )
+    return metrics
 
 
 def _get_resource(resource: Mapping[str, Any], metrics=None):  # type:ignore[no-untyped-def]
     return Resource(
-        resource["id"],
-        resource["name"],
-        resource["type"],
-        resource["group"],
-        resource.get("kind"),
-        resource.get("location"),
-        resource.get("tags", {}),
-        resource.get("properties", {}),
-        resource.get("specific_info", {}),
-        metrics or {},
-        resource.get("subscription"),
+        id=resource["id"],
+        name=resource["name"],
+        type=resource["type"],
+        group=resource["group"],
+        kind=resource.get("kind"),
+        location=resource.get("location"),
+        tags=resource.get("tags", {}),
+        properties=resource.get("properties", {}),
+        specific_info=resource.get("specific_info", {}),
+        metrics=metrics or {},
+        subscription=resource.get("subscription"),
     )
 
 
@@ -115,24 +143,27 @@ def _parse_resource(resource_data: Sequence[Sequence[str]]) -> Resource | None:
     if metrics_num == 0:
         return _get_resource(resource)
 
-    metrics = dict(_get_metrics(resource_data[2 : 2 + metrics_num]))
-    return _get_resource(resource, metrics=metrics)
+    return _get_resource(resource, metrics=_get_metrics(resource_data[2 : 2 + metrics_num]))
 
 
 def parse_resources(string_table: StringTable) -> Mapping[str, Resource]:
-    raw_resources: list[list[Sequence[str]]] = []
+    parsed_resources: dict[str, Resource] = {}
+    resource_data: list[Sequence[str]] | None = None
 
-    # create list of lines per resource
+    # collect the lines per resource and parse them once the next resource starts
     for row in string_table:
         if row == ["Resource"]:
-            raw_resources.append([])
+            if resource_data is not None and (resource := _parse_resource(resource_data)):
+                parsed_resources[resource.name] = resource
+            resource_data = []
             continue
-        if raw_resources:
-            raw_resources[-1].append(row)
+        if resource_data is not None:
+            resource_data.append(row)
 
-    parsed_resources = (_parse_resource(r) for r in raw_resources)
+    if resource_data is not None and (resource := _parse_resource(resource_data)):
+        parsed_resources[resource.name] = resource
 
-    return {r.name: r for r in parsed_resources if r}
+    return parsed_resources
 
 
 #   .--Discovery-----------------------------------------------------------.
@@ -151,10 +182,12 @@ def discover_azure_by_metrics(
 ) -> Callable[[Section], DiscoveryResult]:
     """Return a discovery function, that will discover if any of the metrics are found"""
 
+    desired = frozenset(desired_metrics)
+
     def discovery_function(section: Section) -> DiscoveryResult:
         for item, resource in section.items():
-            if (resource_type is None or resource_type == resource.type) and (
-                set(desired_metrics) & set(resource.metrics)
+            if (resource_type is None or resource_type == resource.type) and not desired.isdisjoint(
+                resource.metrics
             ):
                 yield Service(item=item)
 
@@ -171,45 +204,68 @@ def discover_azure_by_metrics(
 #   +----------------------------------------------------------------------+
 
 
+def _capitalize(string: str) -> str:
+    return string[0].upper() + string[1:]
+
+
 def iter_resource_attributes(
     resource: Resource, include_keys: tuple[str] = ("location",)
 ) -> Iterable[tuple[str, str | None]]:
-    def capitalize(string):
-        return string[0].upper() + string[1:]
-
     for key in include_keys:
         if (value := getattr(resource, key)) is not None:
-            yield capitalize(key), value
+            yield _capitalize(key), value
 
-    for key, value in sorted(resource.tags.items()):
-        if not key.startswith("hidden-"):
-            yield capitalize(key), value
+    for key, value in resource.public_tags:
+        yield _capitalize(key), value
 
 
 def check_azure_metrics(
     metrics_data: Sequence[MetricData],
 ) -> Callable[[str, Mapping[str, Any], Section], CheckResult]:
+    # unpack the metric specs once, they're the same for every check cycle
+    azure_metric_names = tuple(m.azure_metric_name for m in metrics_data)
+    check_levels_args = tuple(
+        (
+            m.upper_levels_param,
+            m.lower_levels_param,
+            m.metric_name,
+            m.metric_label,
+            m.render_func,
+            m.boundaries,
+        )
+        for m in metrics_data
+    )
+
     def check_metric(item: str, params: Mapping[str, Any], section: Section) -> CheckResult:
         resource = section.get(item)
         if not resource:
             raise IgnoreResultsError("Data not present at the moment")
 
-        metrics = [resource.metrics.get(m.azure_metric_name) for m in metrics_data]
-        if not any(metrics):
+        resource_metrics = resource.metrics
+        if not any(name in resource_metrics for name in azure_metric_names):
             raise IgnoreResultsError("Data not present at the moment")
 
-        for metric, metric_data in zip(metrics, metrics_data):
+        metrics = [resource_metrics.get(name) for name in azure_metric_names]
+
+        for metric, (
+            upper_levels_param,
+            lower_levels_param,
+            metric_name,
+            metric_label,
+            render_func,
+            boundaries,
+        ) in zip(metrics, check_levels_args):
             if not metric:
                 continue
 
             yield from check_levels(
                 metric.value,
-                levels_upper=params.get(metric_data.upper_levels_param),
-                levels_lower=params.get(metric_data.lower_levels_param),
-                metric_name=metric_data.metric_name,
-                label=metric_data.metric_label,
-                render_func=metric_data.render_func,
-                boundaries=metric_data.boundaries,
+                levels_upper=params.get(upper_levels_param),
+                levels_lower=params.get(lower_levels_param),
+                metric_name=metric_name,
+                label=metric_label,
+                render_func=render_func,
+                boundaries=boundaries,
             )
 
     return check_metric
@@ -6,7 +6,8 @@
 from __future__ import annotations
 
 import abc
-from collections.abc import Iterable, Sequence
+from collections import defaultdict
+from collections.abc import Callable, Iterable, Sequence
 from contextlib import contextmanager
 from pathlib import Path
 from typing import Any
@@ -39,12 +40,12 @@ from cmk.gui.permissions import (
     PermissionSectionRegistry,
 )
 from cmk.gui.plugins.visuals.utils import Filter, get_livestatus_filter_headers
-from cmk.gui.type_defs import ColumnName, Row, Rows, SingleInfos, VisualContext
+from cmk.gui.type_defs import ColumnName, FilterHTTPVariables, Row, Rows, SingleInfos, VisualContext
 from cmk.gui.utils.escaping import escape_attribute
 from cmk.gui.utils.html import HTML
 from cmk.gui.utils.output_funnel import output_funnel
 from cmk.gui.utils.theme import theme
-from cmk.gui.utils.urls import makeuri, makeuri_contextless, urlencode_vars
+from cmk.gui.utils.urls import makeuri, makeuri_contextless, urlencode, urlencode_vars
 from cmk.gui.valuespec import DropdownChoice, DropdownChoiceEntries, ValueSpec
 from cmk.gui.views.data_source import ABCDataSource, DataSourceRegistry, RowTable
 
@@ -121,11 +122,17 @@ PermissionBISeeAll = Permission(
 
 
 def is_part_of_aggregation(host, service) -> bool:  # type:ignore[no-untyped-def]
-    if BIAggregationPacks.get_num_enabled_aggregations() == 0:
+    if not _has_enabled_aggregations():
         return False
     return get_cached_bi_compiler().is_part_of_aggregation(host, service)
 
 
+@request_memoize()
+def _has_enabled_aggregations() -> bool:
+    # Called once per host/service row, don't read the counter file over and over again
+    return BIAggregationPacks.get_num_enabled_aggregations() != 0
+
+
 def get_aggregation_group_trees():
     # Here we have to deal with weird legacy
     # aggregation group definitions:
@@ -140,6 +147,9 @@ def aggregation_group_choices() -> DropdownChoiceEntries:
     return get_cached_bi_packs().get_aggregation_group_choices()
 
 
+_BI_STATES_WITHOUT_PROBLEM = frozenset((BIStates.OK, BIStates.PENDING))
+
+
 def api_get_aggregation_state(  # type:ignore[no-untyped-def]
     filter_names: list[str] | None = None, filter_groups: list[str] | None = None
 ):
@@ -153,103 +163,125 @@ def api_get_aggregation_state(  # type:ignore[no-untyped-def]
         [],
     )
 
-    def collect_infos(  # type:ignore[no-untyped-def]
-        node_result_bundle: NodeResultBundle, is_single_host_aggregation: bool
-    ):
-        actual_result = node_result_bundle.actual_result
-
-        own_infos = {}
-        if actual_result.custom_infos:
-            own_infos["custom"] = actual_result.custom_infos
-
-        if actual_result.state not in [BIStates.OK, BIStates.PENDING]:
-            node_instance = node_result_bundle.instance
-            line_tokens = []
-            if isinstance(node_instance, BICompiledRule):
-                line_tokens.append(node_instance.properties.title)
-            else:
-                node_info = []
-                if not is_single_host_aggregation:
-                    node_info.append(node_instance.host_name)
-                if node_instance.service_description:
-                    node_info.append(node_instance.service_description)
-                if node_info:
-                    line_tokens.append("/".join(node_info))
-            if actual_result.output:
-                line_tokens.append(actual_result.output)
-            own_infos["error"] = {"state": actual_result.state, "output": ", ".join(line_tokens)}
-
-        nested_infos = [
-            x
-            for y in node_result_bundle.nested_results
-            for x in [collect_infos(y, is_single_host_aggregation)]
-            if x is not None
-        ]
-
-        if own_infos or nested_infos:
-            return [own_infos, nested_infos]
-        return None
-
     aggregations = {}
     results = bi_manager.computer.compute_result_for_filter(bi_aggregation_filter)
     for _compiled_aggregation, node_result_bundles in results:
         for node_result_bundle in node_result_bundles:
-            aggr_title = node_result_bundle.instance.properties.title
-            required_hosts = [x[1] for x in node_result_bundle.instance.get_required_hosts()]
+            instance = node_result_bundle.instance
+            actual_result = node_result_bundle.actual_result
+            required_hosts = [x[1] for x in instance.get_required_hosts()]
             is_single_host_aggregation = len(required_hosts) == 1
-            aggregations[aggr_title] = {
-                "state": node_result_bundle.actual_result.state,
-                "output": node_result_bundle.actual_result.output,
+            aggregations[instance.properties.title] = {
+                "state": actual_result.state,
+                "output": actual_result.output,
                 "hosts": required_hosts,
-                "acknowledged": node_result_bundle.actual_result.acknowledged,
-                "in_downtime": node_result_bundle.actual_result.downtime_state != 0,
-                "in_service_period": node_result_bundle.actual_result.in_service_period,
-                "infos": collect_infos(node_result_bundle, is_single_host_aggregation),
+                "acknowledged": actual_result.acknowledged,
+                "in_downtime": actual_result.downtime_state != 0,
+                "in_service_period": actual_result.in_service_period,
+                "infos": _collect_infos(node_result_bundle, is_single_host_aggregation),
             }
 
     have_sites = {x[0] for x in bi_manager.status_fetcher.states}
-    missing_aggregations = []
-    required_sites = set()
     required_aggregations = bi_manager.computer.get_required_aggregations(bi_aggregation_filter)
-    for _bi_aggregation, branches in required_aggregations:
-        for branch in branches:
-            branch_sites = {x[0] for x in branch.required_elements()}
-            required_sites.update(branch_sites)
-            if branch.properties.title not in aggregations:
-                missing_aggregations.append(branch.properties.title)
+    required_sites = {
+        x[0]
+        for _bi_aggregation, branches in required_aggregations
+        for branch in branches
+        for x in branch.required_elements()
+    }
+    missing_aggregations = [
+        branch.properties.title
+        for _bi_aggregation, branches in required_aggregations
+        for branch in branches
+        if branch.properties.title not in aggregations
+    ]
 
     response = {
         "aggregations": aggregations,
-        "missing_sites": list(required_sites - have_sites),
+        "missing_sites": [site for site in required_sites if site not in have_sites],
         "missing_aggr": missing_aggregations,
     }
     return response
 
 
+def _collect_infos(
+    root_bundle: NodeResultBundle, is_single_host_aggregation: bool
+) -> list[Any] | None:
+    """Collect the infos of all nodes, nested like [own_infos, nested_infos]
+
+    Nodes without own infos and without any nested infos are left out. The tree is walked with
+    an explicit stack, so deep aggregations don't run into the recursion limit.
+    """
+    # Flatten the tree in pre-order, remembering the index of each parent
+    bundles: list[tuple[NodeResultBundle, int]] = []
+    stack: list[tuple[NodeResultBundle, int]] = [(root_bundle, -1)]
+    while stack:
+        bundle, parent_index = stack.pop()
+        index = len(bundles)
+        bundles.append((bundle, parent_index))
+        stack.extend((nested, index) for nested in reversed(bundle.nested_results))
+
+    # Children come after their parent, so walking backwards completes them first. They are
+    # collected in reverse order this way.
+    nested_infos_by_index: list[list[Any]] = [[] for _bundle in bundles]
+    infos: list[Any] | None = None
+    for index in range(len(bundles) - 1, -1, -1):
+        bundle, parent_index = bundles[index]
+        own_infos = _own_infos(bundle, is_single_host_aggregation)
+        nested_infos = nested_infos_by_index[index]
+        nested_infos.reverse()
+
+        infos = [own_infos, nested_infos] if own_infos or nested_infos else None
+        if infos is not None and parent_index >= 0:
+            nested_infos_by_index[parent_index].append(infos)
+
+    return infos
+
+
+def _own_infos(node_result_bundle: NodeResultBundle, is_single_host_aggregation: bool) -> dict:
+    actual_result = node_result_bundle.actual_result
+
+    own_infos: dict[str, Any] = {}
+    if actual_result.custom_infos:
+        own_infos["custom"] = actual_result.custom_infos
+
+    if actual_result.state not in _BI_STATES_WITHOUT_PROBLEM:
+        node_instance = node_result_bundle.instance
+        line_tokens = []
+        if isinstance(node_instance, BICompiledRule):
+            line_tokens.append(node_instance.properties.title)
+        else:
+            node_info = []
+            if not is_single_host_aggregation:
+                node_info.append(node_instance.host_name)
+            if node_instance.service_description:
+                node_info.append(node_instance.service_description)
+            if node_info:
+                line_tokens.append("/".join(node_info))
+        if actual_result.output:
+            line_tokens.append(actual_result.output)
+        own_infos["error"] = {"state": actual_result.state, "output": ", ".join(line_tokens)}
+
+    return own_infos
+
+
 def check_title_uniqueness(forest):
     # Legacy, will be removed any decade from now
     # One aggregation cannot be in mutliple groups.
-    known_titles: set[Any] = set()
-    for aggrs in forest.values():
-        for aggr in aggrs:
-            title = aggr["title"]
-            if title in known_titles:
-                raise MKConfigError(
-                    _(
-                        'Duplicate BI aggregation with the title "<b>%s</b>". '
-                        "Please check your BI configuration and make sure that within each group no aggregation has "
-                        "the same title as any other. Note: you can use arguments in the top level "
-                        "aggregation rule, like <tt>Host $HOST$</tt>."
-                    )
-                    % (escaping.escape_attribute(title))
-                )
-            known_titles.add(title)
+    _check_titles_unique([aggr["title"] for aggrs in forest.values() for aggr in aggrs])
 
 
 def check_aggregation_title_uniqueness(aggregations):
+    _check_titles_unique([attrs["title"] for attrs in aggregations.values()])
+
+
+def _check_titles_unique(titles: list[Any]) -> None:
+    if len(set(titles)) == len(titles):
+        return
+
+    # Only walk the titles in case there is a duplicate, to report the first one
     known_titles: set[Any] = set()
-    for attrs in aggregations.values():
-        title = attrs["title"]
+    for title in titles:
         if title in known_titles:
             raise MKConfigError(
                 _(
@@ -318,17 +350,8 @@ def ajax_render_tree():
     )
     rows = bi_manager.computer.compute_legacy_result_for_filter(bi_aggregation_filter)
 
-    # TODO: Cleanup the renderer to use a class registry for lookup
-    renderer_class_name = request.var("renderer")
-    if renderer_class_name == "FoldableTreeRendererTree":
-        renderer_cls: type[ABCFoldableTreeRenderer] = FoldableTreeRendererTree
-    elif renderer_class_name == "FoldableTreeRendererBoxes":
-        renderer_cls = FoldableTreeRendererBoxes
-    elif renderer_class_name == "FoldableTreeRendererBottomUp":
-        renderer_cls = FoldableTreeRendererBottomUp
-    elif renderer_class_name == "FoldableTreeRendererTopDown":
-        renderer_cls = FoldableTreeRendererTopDown
-    else:
+    renderer_cls = _RENDERER_CLASSES.get(request.var("renderer") or "")
+    if renderer_cls is None:
         raise NotImplementedError()
 
     renderer = renderer_cls(
@@ -351,72 +374,85 @@ def render_tree_json(row) -> dict[str, Any]:  # type:ignore[no-untyped-def]
         user.save_tree_states()
 
     def render_node_json(tree, show_host) -> dict[str, Any]:  # type:ignore[no-untyped-def]
-        is_leaf = len(tree) == 3
+        state, assumed_state, rule, *rest = tree
+        is_leaf = not rest
         if is_leaf:
-            service = tree[2].get("service")
+            service = rule.get("service")
             if not service:
                 title = _("Host status")
             else:
                 title = service
         else:
-            title = tree[2]["title"]
+            title = rule["title"]
 
         json_node = {
             "title": title,
             # 2 -> This element is currently in a scheduled downtime
             # 1 -> One of the subelements is in a scheduled downtime
-            "in_downtime": tree[0]["in_downtime"],
-            "acknowledged": tree[0]["acknowledged"],
-            "in_service_period": tree[0]["in_service_period"],
+            "in_downtime": state["in_downtime"],
+            "acknowledged": state["acknowledged"],
+            "in_service_period": state["in_service_period"],
         }
 
         if is_leaf:
-            site, hostname = tree[2]["host"]
+            site, hostname = rule["host"]
             json_node["site"] = site
             json_node["hostname"] = hostname
 
-        # Check if we have an assumed state: comparing assumed state (tree[1]) with state (tree[0])
-        if tree[1] and tree[0] != tree[1]:
+        # Check if we have an assumed state: comparing assumed state with state
+        if assumed_state and state != assumed_state:
             json_node["assumed"] = True
-            effective_state = tree[1]
+            effective_state = assumed_state
         else:
             json_node["assumed"] = False
-            effective_state = tree[0]
+            effective_state = state
 
         json_node["state"] = effective_state["state"]
-        json_node["output"] = compute_output_message(effective_state, tree[2])
+        json_node["output"] = compute_output_message(effective_state, rule)
         return json_node
 
-    def render_subtree_json(node, path, show_host) -> dict[str, Any]:  # type:ignore[no-untyped-def]
-        json_node = render_node_json(node, show_host)
+    root_node = row["aggr_treestate"]
+    affected_hosts = row["aggr_hosts"]
+    show_host = len(affected_hosts) > 1
+
+    # Walk the tree with an explicit stack instead of recursing per node. The JSON nodes of the
+    # children are attached to their parent right away, so the order of the walk doesn't matter.
+    root_json_node = render_node_json(root_node, show_host)
+    stack: list[tuple[Any, list[str], dict[str, Any]]] = [
+        (root_node, [root_node[2]["title"]], root_json_node)
+    ]
+    while stack:
+        node, path, json_node = stack.pop()
 
         is_leaf = len(node) == 3
         is_next_level_open = len(path) <= expansion_level
+        if is_leaf or not is_next_level_open:
+            continue
 
-        if not is_leaf and is_next_level_open:
-            json_node["nodes"] = []
-            for child_node in node[3]:
-                if not child_node[2].get("hidden"):
-                    new_path = path + [child_node[2]["title"]]
-                    json_node["nodes"].append(render_subtree_json(child_node, new_path, show_host))
-
-        return json_node
-
-    root_node = row["aggr_treestate"]
-    affected_hosts = row["aggr_hosts"]
+        child_json_nodes: list[dict[str, Any]] = []
+        for child_node in node[3]:
+            if not child_node[2].get("hidden"):
+                child_json_node = render_node_json(child_node, show_host)
+                child_json_nodes.append(child_json_node)
+                stack.append((child_node, path + [child_node[2]["title"]], child_json_node))
+        json_node["nodes"] = child_json_nodes
 
-    return render_subtree_json(root_node, [root_node[2]["title"]], len(affected_hosts) > 1)
+    return root_json_node
 
 
 def compute_output_message(effective_state, rule):
-    output = []
-    if effective_state["output"]:
-        output.append(effective_state["output"])
+    output = effective_state["output"] or ""
+
+    # Most rules don't define state messages
+    if not (state_messages := rule.get("state_messages")):
+        return output
 
     str_state = str(effective_state["state"])
-    if str_state in rule.get("state_messages", {}):
-        output.append(escaping.escape_attribute(rule["state_messages"][str_state]))
-    return ", ".join(output)
+    if str_state not in state_messages:
+        return output
+
+    state_message = escaping.escape_attribute(state_messages[str_state])
+    return f"{output}, {state_message}" if output else state_message
 
 
 # possible aggregated states
@@ -428,6 +464,16 @@ CRIT = 2
 UNKNOWN = 3
 UNAVAIL = 4
 
+_BI_STATE_LABELS = {
+    PENDING: _l("PD"),
+    OK: _l("OK"),
+    WARN: _l("WA"),
+    CRIT: _l("CR"),
+    UNKNOWN: _l("UN"),
+    MISSING: _l("MI"),
+    UNAVAIL: _l("NA"),
+}
+
 
 class ABCFoldableTreeRenderer(abc.ABC):
     def __init__(  # type:ignore[no-untyped-def]
@@ -439,6 +485,12 @@ class ABCFoldableTreeRenderer(abc.ABC):
         self._only_problems = only_problems
         self._lazy = lazy
         self._wrap_texts = wrap_texts
+        # Looked up for every leaf. Fetch them once, the property reloads the file as long as
+        # there are no assumptions.
+        self._assumptions = user.bi_assumptions
+        self._host_urls: dict[tuple[SiteId, HostName], str] = {}
+        self._shall_escape = active_config.escape_plugin_output
+        self._tree_closed_url = theme.url("images/tree_closed.svg")
         self._load_tree_state()
 
     def _load_tree_state(self):
@@ -447,6 +499,8 @@ class ABCFoldableTreeRenderer(abc.ABC):
             self._treestate = {}
             user.set_tree_states("bi", self._treestate)
             user.save_tree_states()
+        # Looked up for every node
+        self._treestate_get = self._treestate.get
 
     @abc.abstractmethod
     def css_class(self):
@@ -495,8 +549,9 @@ class ABCFoldableTreeRenderer(abc.ABC):
         # remove subtrees in state OK
         new_subtrees = []
         for subtree in subtrees:
-            effective_state = subtree[1] if subtree[1] is not None else subtree[0]
-            if effective_state["state"] not in [OK, PENDING]:
+            sub_state, sub_assumed_state, *_rest = subtree
+            effective_state = sub_assumed_state if sub_assumed_state is not None else sub_state
+            if effective_state["state"] not in (OK, PENDING):
                 if len(subtree) == 3:
                     new_subtrees.append(subtree)
                 else:
@@ -510,8 +565,8 @@ class ABCFoldableTreeRenderer(abc.ABC):
     def _path_id(self, path):
         return "/".join(path)
 
-    def _is_open(self, path) -> bool:  # type:ignore[no-untyped-def]
-        is_open = self._treestate.get(self._path_id(path))
+    def _is_open(self, path, path_id=None) -> bool:  # type:ignore[no-untyped-def]
+        is_open = self._treestate_get(self._path_id(path) if path_id is None else path_id)
         if is_open is None:
             is_open = len(path) <= self._expansion_level
 
@@ -521,11 +576,11 @@ class ABCFoldableTreeRenderer(abc.ABC):
 
         return is_open
 
-    def _omit_content(self, path):
-        return self._lazy and not self._is_open(path)
+    def _omit_content(self, path, path_id=None):
+        return self._lazy and not self._is_open(path, path_id)
 
-    def _get_mousecode(self, path):
-        return "%s(this, %d);" % (self._toggle_js_function(), self._omit_content(path))
+    def _get_mousecode(self, path, path_id=None):
+        return "%s(this, %d);" % (self._toggle_js_function(), self._omit_content(path, path_id))
 
     @abc.abstractmethod
     def _toggle_js_function(self):
@@ -542,11 +597,13 @@ class ABCFoldableTreeRenderer(abc.ABC):
         # (4) CPU load                  (show_host == False, service is not None)
 
         if show_host or not service:
-            host_url = makeuri_contextless(
-                request,
-                [("view_name", "hoststatus"), ("site", site), ("host", host)],
-                filename="view.py",
-            )
+            # The host is usually shown for many of the leaves
+            if (host_url := self._host_urls.get((site, host))) is None:
+                host_url = self._host_urls[(site, host)] = makeuri_contextless(
+                    request,
+                    [("view_name", "hoststatus"), ("site", site), ("host", host)],
+                    filename="view.py",
+                )
 
         if service:
             service_url = makeuri_contextless(
@@ -572,7 +629,7 @@ class ABCFoldableTreeRenderer(abc.ABC):
         raise NotImplementedError()
 
     def _assume_icon(self, site, host, service):
-        ass = user.bi_assumptions.get(_get_state_assumption_key(site, host, service))
+        ass = self._assumptions.get(_get_state_assumption_key(site, host, service))
         current_state = str(ass).lower()
 
         html.icon_button(
@@ -585,15 +642,9 @@ class ABCFoldableTreeRenderer(abc.ABC):
         )
 
     def _render_bi_state(self, state: int) -> str:
-        return {
-            PENDING: _("PD"),
-            OK: _("OK"),
-            WARN: _("WA"),
-            CRIT: _("CR"),
-            UNKNOWN: _("UN"),
-            MISSING: _("MI"),
-            UNAVAIL: _("NA"),
-        }.get(state, _("??"))
+        if (label := _BI_STATE_LABELS.get(state)) is None:
+            return _("??")
+        return str(label)
 
 
 class FoldableTreeRendererTree(ABCFoldableTreeRenderer):
@@ -604,48 +655,53 @@ class FoldableTreeRendererTree(ABCFoldableTreeRenderer):
         return "cmk.bi.toggle_subtree"
 
     def _show_subtree(self, tree, path, show_host):
-        if self._is_leaf(tree):
+        if len(tree) == 3:
             self._show_leaf(tree, show_host)
             return
 
+        rule = tree[2]
+        subtrees = tree[3]
+
         html.open_span(class_="title")
 
-        is_empty = len(tree[3]) == 0
+        path_id = self._path_id(path)
+        is_empty = not subtrees
         if is_empty:
             mc = None
         else:
-            mc = self._get_mousecode(path)
+            mc = self._get_mousecode(path, path_id)
 
-        css_class = "open" if self._is_open(path) else "closed"
+        is_open = self._is_open(path, path_id)
+        css_class = "open" if is_open else "closed"
 
         with self._show_node(tree, show_host, mousecode=mc, img_class=css_class):
-            if tree[2].get("icon"):
-                html.write_html(html.render_icon(tree[2]["icon"]))
+            if icon := rule.get("icon"):
+                html.write_html(html.render_icon(icon))
                 html.write_text("&nbsp;")
 
-            if tree[2].get("docu_url"):
+            if docu_url := rule.get("docu_url"):
                 html.icon_button(
-                    tree[2]["docu_url"],
+                    docu_url,
                     _("Context information about this rule"),
                     "url",
                     target="_blank",
                 )
                 html.write_text("&nbsp;")
 
-            html.write_text(tree[2]["title"])
+            html.write_text(rule["title"])
 
         if not is_empty:
             html.open_ul(
-                id_="%d:%s" % (self._expansion_level or 0, self._path_id(path)),
+                id_=f"{self._expansion_level or 0}:{path_id}",
                 class_=["subtree", css_class],
             )
 
-            if not self._omit_content(path):
-                for node in tree[3]:
-                    if not node[2].get("hidden"):
-                        new_path = path + [node[2]["title"]]
+            if not self._lazy or is_open:
+                for node in subtrees:
+                    node_rule = node[2]
+                    if not node_rule.get("hidden"):
                         html.open_li()
-                        self._show_subtree(node, new_path, show_host)
+                        self._show_subtree(node, path + [node_rule["title"]], show_host)
                         html.close_li()
 
             html.close_ul()
@@ -680,7 +736,7 @@ class FoldableTreeRendererTree(ABCFoldableTreeRenderer):
         if mousecode:
             if img_class:
                 html.img(
-                    src=theme.url("images/tree_closed.svg"),
+                    src=self._tree_closed_url,
                     class_=["treeangle", img_class],
                     onclick=mousecode,
                 )
@@ -718,7 +774,7 @@ class FoldableTreeRendererTree(ABCFoldableTreeRenderer):
             html.close_span()
 
         output: HTML = cmk.gui.view_utils.format_plugin_output(
-            effective_state["output"], shall_escape=active_config.escape_plugin_output
+            effective_state["output"], shall_escape=self._shall_escape
         )
         if output:
             output = HTMLWriter.render_b(HTML("&diams;"), class_="bullet") + output
@@ -736,26 +792,30 @@ class FoldableTreeRendererBoxes(ABCFoldableTreeRenderer):
         return "cmk.bi.toggle_box"
 
     def _show_subtree(self, tree, path, show_host):
-        # Check if we have an assumed state: comparing assumed state (tree[1]) with state (tree[0])
-        if tree[1] and tree[0] != tree[1]:
+        state, assumed_state, rule, *rest = tree
+        is_leaf = not rest
+
+        # Check if we have an assumed state: comparing assumed state with state
+        if assumed_state and state != assumed_state:
             addclass = ["assumed"]
-            effective_state = tree[1]
+            effective_state = assumed_state
         else:
             addclass = []
-            effective_state = tree[0]
+            effective_state = state
 
-        is_leaf = self._is_leaf(tree)
+        path_id = self._path_id(path)
         if is_leaf:
             leaf = "leaf"
             mc = None
         else:
             leaf = "noleaf"
-            mc = self._get_mousecode(path)
+            mc = self._get_mousecode(path, path_id)
 
+        is_open = self._is_open(path, path_id)
         classes = [
             "bibox_box",
             leaf,
-            "open" if self._is_open(path) else "closed",
+            "open" if is_open else "closed",
             "state",
             "state%d" % effective_state["state"],
         ] + addclass
@@ -763,7 +823,7 @@ class FoldableTreeRendererBoxes(ABCFoldableTreeRenderer):
         omit = self._omit_root and len(path) == 1
         if not omit:
             html.open_span(
-                id_="%d:%s" % (self._expansion_level or 0, self._path_id(path)),
+                id_=f"{self._expansion_level or 0}:{path_id}",
                 class_=classes,
                 onclick=mc,
             )
@@ -771,18 +831,17 @@ class FoldableTreeRendererBoxes(ABCFoldableTreeRenderer):
             if is_leaf:
                 self._show_leaf(tree, show_host)
             else:
-                html.write_text(tree[2]["title"].replace(" ", "&nbsp;"))
+                html.write_text(rule["title"].replace(" ", "&nbsp;"))
 
             html.close_span()
 
-        if not is_leaf and not self._omit_content(path):
+        if not is_leaf and (not self._lazy or is_open):
             html.open_span(
                 class_="bibox",
-                style="display: none;" if not self._is_open(path) and not omit else "",
+                style="display: none;" if not is_open and not omit else "",
             )
-            for node in tree[3]:
-                new_path = path + [node[2]["title"]]
-                self._show_subtree(node, new_path, show_host)
+            for node in rest[0]:
+                self._show_subtree(node, path + [node[2]["title"]], show_host)
             html.close_span()
 
     @contextmanager
@@ -807,7 +866,10 @@ class ABCFoldableTreeRendererTable(FoldableTreeRendererTree):
 
         tree = self._get_tree()
         depth = status_tree_depth(tree)
-        leaves = self._gen_table(tree, depth, len(self._row["aggr_hosts"]) > 1)
+        # Each cell is written to and drained from this one plugged output, instead of plugging
+        # a fresh one for every node
+        with output_funnel.plugged():
+            leaves = self._gen_table(tree, depth, len(self._row["aggr_hosts"]) > 1)
 
         html.open_table(class_=["aggrtree", "ltr"])
         odd = "odd"
@@ -819,16 +881,17 @@ class ABCFoldableTreeRendererTable(FoldableTreeRendererTree):
             )
             odd = "even" if odd == "odd" else "odd"
 
-            tds = [leaf_td]
+            # The rendered cells are already HTML, join them as plain strings
+            tds = [str(leaf_td)]
             for rowspan, c in parents:
                 tds.append(
-                    HTMLWriter.render_td(c, class_=["node"], style=td_style, rowspan=rowspan)
+                    str(HTMLWriter.render_td(c, class_=["node"], style=td_style, rowspan=rowspan))
                 )
 
             if self._mirror:
                 tds.reverse()
 
-            html.write_html(HTML("").join(tds))
+            html.write_html(HTML("".join(tds)))
             html.close_tr()
 
         html.close_table()
@@ -839,10 +902,8 @@ class ABCFoldableTreeRendererTable(FoldableTreeRendererTree):
         return self._gen_node(tree, height, show_host)
 
     def _gen_leaf(self, tree, height, show_host):
-        with output_funnel.plugged():
-            self._show_leaf(tree, show_host)
-            content = HTML(output_funnel.drain())
-        return [(content, height, [])]
+        self._show_leaf(tree, show_host)
+        return [(HTML(output_funnel.drain()), height, [])]
 
     def _gen_node(self, tree, height, show_host):
         leaves: list[Any] = []
@@ -850,15 +911,15 @@ class ABCFoldableTreeRendererTable(FoldableTreeRendererTree):
             if not node[2].get("hidden"):
                 leaves += self._gen_table(node, height - 1, show_host)
 
-        with output_funnel.plugged():
-            html.open_div(class_="aggr_tree")
-            with self._show_node(tree, show_host):
-                html.write_text(tree[2]["title"])
-            html.close_div()
-            content = HTML(output_funnel.drain())
+        # Without any visible leaves below it, the node has no row to be shown in
+        if not leaves:
+            return leaves
 
-        if leaves:
-            leaves[0][2].append((len(leaves), content))
+        html.open_div(class_="aggr_tree")
+        with self._show_node(tree, show_host):
+            html.write_text(tree[2]["title"])
+        html.close_div()
+        leaves[0][2].append((len(leaves), HTML(output_funnel.drain())))
 
         return leaves
 
@@ -866,31 +927,54 @@ class ABCFoldableTreeRendererTable(FoldableTreeRendererTree):
 def find_all_leaves(  # type:ignore[no-untyped-def]
     node,
 ) -> list[tuple[str | None, HostName, ServiceName | None]]:
-    # leaf node
-    if node["type"] == 1:
-        site, host = node["host"]
-        return [(site, host, node.get("service"))]
+    entries: list[tuple[str | None, HostName, ServiceName | None]] = []
+    # Depth first, the children are pushed in reverse to keep the order of the leaves
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        node_type = node["type"]
 
-    # rule node
-    if node["type"] == 2:
-        entries: list[Any] = []
-        for n in node["nodes"]:
-            entries += find_all_leaves(n)
-        return entries
+        # leaf node
+        if node_type == 1:
+            site, host = node["host"]
+            entries.append((site, host, node.get("service")))
 
-    # place holders
-    return []
+        # rule node
+        elif node_type == 2:
+            stack.extend(reversed(node["nodes"]))
+
+        # place holders are skipped
+    return entries
 
 
 def status_tree_depth(tree):
-    if len(tree) == 3:
-        return 1
+    # The same tree is rendered by several table painters of a view, compute its depth only once
+    depths = _status_tree_depths()
+    if (cached := depths.get(id(tree))) is not None and cached[0] is tree:
+        return cached[1]
+
+    depth = _status_tree_depth(tree)
+    depths[id(tree)] = (tree, depth)
+    return depth
 
-    subtrees = tree[3]
+
+@request_memoize()
+def _status_tree_depths() -> dict[int, tuple[Any, int]]:
+    # The trees are kept together with their depth, so their id() is not reused during a request
+    return {}
+
+
+def _status_tree_depth(tree):
+    # The depth of the tree is the deepest level of any of its nodes, leaves have no subtrees
     maxdepth = 0
-    for node in subtrees:
-        maxdepth = max(maxdepth, status_tree_depth(node))
-    return maxdepth + 1
+    stack = [(tree, 1)]
+    while stack:
+        node, depth = stack.pop()
+        if depth > maxdepth:
+            maxdepth = depth
+        if len(node) != 3:
+            stack.extend((subtree, depth + 1) for subtree in node[3])
+    return maxdepth
 
 
 class FoldableTreeRendererBottomUp(ABCFoldableTreeRendererTable):
@@ -901,36 +985,27 @@ class FoldableTreeRendererTopDown(ABCFoldableTreeRendererTable):
     _mirror = True
 
 
+# The renderer is selected by its class name, which is sent back by the tree container
+_RENDERER_CLASSES: dict[str, type[ABCFoldableTreeRenderer]] = {
+    cls.__name__: cls
+    for cls in (
+        FoldableTreeRendererTree,
+        FoldableTreeRendererBoxes,
+        FoldableTreeRendererBottomUp,
+        FoldableTreeRendererTopDown,
+    )
+}
+
+
 def compute_bi_aggregation_filter(
     context: VisualContext, all_active_filters: Iterable[Filter]
 ) -> BIAggregationFilter:
-    only_hosts = []
-    only_group = []
-    only_service = []
-    only_aggr_name = []
-    group_prefix = []
-
+    filter_values: dict[str, list[Any]] = {}
     for active_filter in all_active_filters:
-        conf = context.get(active_filter.ident, {})
-
-        if active_filter.ident == "aggr_hosts":
-            if (host_name := conf.get("aggr_host_host", "")) != "":
-                only_hosts = [host_name]
-        elif active_filter.ident == "aggr_group":
-            if aggr_group := conf.get(active_filter.htmlvars[0]):
-                only_group = [aggr_group]
-        elif active_filter.ident == "aggr_service":
-            service_spec = tuple(conf.get(var, "") for var in active_filter.htmlvars)
-            # service_spec: site_id, host, service
-            # Since no data has been fetched yet, the site is also unknown
-            if all(service_spec):
-                only_service = [(service_spec[1], service_spec[2])]
-        elif active_filter.ident == "aggr_name":
-            if aggr_name := conf.get("aggr_name"):
-                only_aggr_name = [aggr_name]
-        elif active_filter.ident == "aggr_group_tree":
-            if group_name := conf.get("aggr_group_tree"):
-                group_prefix = [group_name]
+        if (handler := _BI_AGGREGATION_FILTER_HANDLERS.get(active_filter.ident)) is None:
+            continue
+        if (value := handler(context.get(active_filter.ident, {}), active_filter)) is not None:
+            filter_values[value[0]] = [value[1]]
 
     # BIAggregationFilter
     # ("hosts", List[HostName]),
@@ -940,15 +1015,70 @@ def compute_bi_aggregation_filter(
     # ("aggr_groups", List[str]),
     # ("aggr_paths", List[List[str]]),
     return BIAggregationFilter(
-        only_hosts,  # hosts
-        only_service,  # services
+        filter_values.get("hosts", []),  # hosts
+        filter_values.get("services", []),  # services
         [],  # ids
-        only_aggr_name,  # names
-        only_group,  # groups
-        group_prefix,  # paths
+        filter_values.get("names", []),  # names
+        filter_values.get("groups", []),  # groups
+        filter_values.get("paths", []),  # paths
     )
 
 
+def _aggr_hosts_filter_value(
+    conf: FilterHTTPVariables, active_filter: Filter
+) -> tuple[str, Any] | None:
+    if (host_name := conf.get("aggr_host_host", "")) != "":
+        return "hosts", host_name
+    return None
+
+
+def _aggr_group_filter_value(
+    conf: FilterHTTPVariables, active_filter: Filter
+) -> tuple[str, Any] | None:
+    if aggr_group := conf.get(active_filter.htmlvars[0]):
+        return "groups", aggr_group
+    return None
+
+
+def _aggr_service_filter_value(
+    conf: FilterHTTPVariables, active_filter: Filter
+) -> tuple[str, Any] | None:
+    service_spec = tuple(conf.get(var, "") for var in active_filter.htmlvars)
+    # service_spec: site_id, host, service
+    # Since no data has been fetched yet, the site is also unknown
+    if all(service_spec):
+        return "services", (service_spec[1], service_spec[2])
+    return None
+
+
+def _aggr_name_filter_value(
+    conf: FilterHTTPVariables, active_filter: Filter
+) -> tuple[str, Any] | None:
+    if aggr_name := conf.get("aggr_name"):
+        return "names", aggr_name
+    return None
+
+
+def _aggr_group_tree_filter_value(
+    conf: FilterHTTPVariables, active_filter: Filter
+) -> tuple[str, Any] | None:
+    if group_name := conf.get("aggr_group_tree"):
+        return "paths", group_name
+    return None
+
+
+# Only few of the active filters of a view are BI filters, the others are skipped by one lookup
+_BI_AGGREGATION_FILTER_HANDLERS: dict[
+    str, Callable[[FilterHTTPVariables, Filter], tuple[str, Any] | None]
+] = {
+    "aggr_hosts": _aggr_hosts_filter_value,
+    "aggr_group": _aggr_group_filter_value,
+    "aggr_service": _aggr_service_filter_value,
+    "aggr_name": _aggr_name_filter_value,
+    "aggr_group_tree": _aggr_group_tree_filter_value,
+}
+
+
 def table(
     context: VisualContext,
     columns: list[ColumnName],
@@ -958,7 +1088,7 @@ def table(
     all_active_filters: Iterable[Filter],
 ) -> list[dict]:
     bi_aggregation_filter = compute_bi_aggregation_filter(context, all_active_filters)
-    bi_manager = BIManager()
+    bi_manager = get_cached_bi_manager()
     bi_manager.status_fetcher.set_assumed_states(user.bi_assumptions)
     return bi_manager.computer.compute_legacy_result_for_filter(bi_aggregation_filter)
 
@@ -1038,7 +1168,7 @@ def singlehost_table(
     host_columns = [c for c in columns if c.startswith("host_")]
 
     rows = []
-    bi_manager = BIManager()
+    bi_manager = get_cached_bi_manager()
     bi_manager.status_fetcher.set_assumed_states(user.bi_assumptions)
     bi_aggregation_filter = compute_bi_aggregation_filter(context, all_active_filters)
     required_aggregations = bi_manager.computer.get_required_aggregations(bi_aggregation_filter)
@@ -1046,21 +1176,39 @@ def singlehost_table(
         filterheaders, only_sites, limit, host_columns, bygroup, required_aggregations
     )
 
+    # Only branches with at least one of the fetched hosts end up in a row, don't compute the others
+    fetched_hosts = bi_manager.status_fetcher.states.keys()
+    required_aggregations = [
+        (
+            compiled_aggregation,
+            [branch for branch in branches if not fetched_hosts.isdisjoint(branch.required_hosts)],
+        )
+        for compiled_aggregation, branches in required_aggregations
+    ]
+
     aggregation_results = bi_manager.computer.compute_results(required_aggregations)
     legacy_results = bi_manager.computer.convert_to_legacy_results(
         aggregation_results, bi_aggregation_filter
     )
 
+    # Index the results by host, instead of checking every result for every host
+    legacy_results_by_host: dict[tuple[SiteId, HostName], list[dict]] = defaultdict(list)
+    for legacy_result in legacy_results:
+        for site_host_name in legacy_result["aggr_hosts"]:
+            host_results = legacy_results_by_host[tuple(site_host_name)]
+            if not host_results or host_results[-1] is not legacy_result:
+                host_results.append(legacy_result)
+
     for site_host_name, values in bi_manager.status_fetcher.states.items():
-        for legacy_result in legacy_results:
-            if site_host_name in legacy_result["aggr_hosts"]:
-                # Combine bi columns + extra livestatus columns + bi computation columns into one row
-                row = values._asdict()
-                row.update(row["remaining_row_keys"])
-                del row["remaining_row_keys"]
-                row.update(legacy_result)
-                row["site"] = site_host_name[0]
-                rows.append(row)
+        if not (host_results := legacy_results_by_host.get(site_host_name)):
+            continue
+
+        # Combine bi columns + extra livestatus columns + bi computation columns into one row.
+        # The host part is the same for all aggregations of the host.
+        host_row = values._asdict()
+        host_row.update(host_row.pop("remaining_row_keys"))
+        site = site_host_name[0]
+        rows.extend({**host_row, **legacy_result, "site": site} for legacy_result in host_results)
     return rows
 
 
@@ -1328,40 +1476,44 @@ class PainterAggrIcons(Painter):
         return False
 
     def render(self, row: Row, cell: Cell) -> CellSpec:
-        single_url = "view.py?" + urlencode_vars(
-            [("view_name", "aggr_single"), ("aggr_name", row["aggr_name"])]
-        )
+        # Only the aggregation name differs between the rows, quote it once for all the links.
+        # The variables are in the order urlencode_vars() would sort them to.
+        aggr_name_var = "aggr_name=" + urlencode(row["aggr_name"])
+        single_url = "view.py?" + aggr_name_var + "&view_name=aggr_single"
         avail_url = single_url + "&mode=availability"
+        bi_map_url = "bi_map.py?" + aggr_name_var
 
-        bi_map_url = "bi_map.py?" + urlencode_vars(
-            [
-                ("aggr_name", row["aggr_name"]),
-            ]
-        )
-
-        with output_funnel.plugged():
-            html.icon_button(bi_map_url, _("Visualize this aggregation"), "aggr")
-            html.icon_button(single_url, _("Show only this aggregation"), "showbi")
-            html.icon_button(
+        effective_state = row["aggr_effective_state"]
+        icons = [
+            html.render_icon_button(bi_map_url, _("Visualize this aggregation"), "aggr"),
+            html.render_icon_button(single_url, _("Show only this aggregation"), "showbi"),
+            html.render_icon_button(
                 avail_url, _("Analyse availability of this aggregation"), "availability"
-            )
-            if row["aggr_effective_state"]["in_downtime"] != 0:
-                html.icon(
+            ),
+        ]
+        if effective_state["in_downtime"] != 0:
+            icons.append(
+                html.render_icon(
                     "derived_downtime", _("A service or host in this aggregation is in downtime.")
                 )
-            if row["aggr_effective_state"]["acknowledged"]:
-                html.icon(
+            )
+        if effective_state["acknowledged"]:
+            icons.append(
+                html.render_icon(
                     "ack",
                     _(
                         "The critical problems that make this aggregation non-OK have been acknowledged."
                     ),
                 )
-            if not row["aggr_effective_state"]["in_service_period"]:
-                html.icon(
+            )
+        if not effective_state["in_service_period"]:
+            icons.append(
+                html.render_icon(
                     "outof_serviceperiod",
                     _("This aggregation is currently out of its service period."),
                 )
-            code = HTML(output_funnel.drain())
+            )
+        code = HTML("").join(icons)
         return "buttons", code
 
 
@@ -1595,17 +1747,24 @@ class PainterOptionAggrExpand(PainterOption):
 
     @property
     def valuespec(self) -> ValueSpec:
-        return DropdownChoice(
-            title=_("Initial expansion of aggregations"),
-            default_value="0",
-            choices=[
-                ("0", _("collapsed")),
-                ("1", _("first level")),
-                ("2", _("two levels")),
-                ("3", _("three levels")),
-                ("999", _("complete")),
-            ],
-        )
+        return _aggr_expand_valuespec()
+
+
+# The painter options are read for every painted row. Build their valuespecs once per request,
+# they can't be cached any longer because of the localized titles.
+@request_memoize()
+def _aggr_expand_valuespec() -> DropdownChoice[str]:
+    return DropdownChoice(
+        title=_("Initial expansion of aggregations"),
+        default_value="0",
+        choices=[
+            ("0", _("collapsed")),
+            ("1", _("first level")),
+            ("2", _("two levels")),
+            ("3", _("three levels")),
+            ("999", _("complete")),
+        ],
+    )
 
 
 class PainterOptionAggrOnlyProblems(PainterOption):
@@ -1615,14 +1774,19 @@ class PainterOptionAggrOnlyProblems(PainterOption):
 
     @property
     def valuespec(self) -> ValueSpec:
-        return DropdownChoice(
-            title=_("Show only problems"),
-            default_value="0",
-            choices=[
-                ("0", _("show all")),
-                ("1", _("show only problems")),
-            ],
-        )
+        return _aggr_only_problems_valuespec()
+
+
+@request_memoize()
+def _aggr_only_problems_valuespec() -> DropdownChoice[str]:
+    return DropdownChoice(
+        title=_("Show only problems"),
+        default_value="0",
+        choices=[
+            ("0", _("show all")),
+            ("1", _("show only problems")),
+        ],
+    )
 
 
 class PainterOptionAggrTreeType(PainterOption):
@@ -1632,17 +1796,22 @@ class PainterOptionAggrTreeType(PainterOption):
 
     @property
     def valuespec(self) -> ValueSpec:
-        return DropdownChoice(
-            title=_("Type of tree layout"),
-            default_value="foldable",
-            choices=[
-                ("foldable", _("Foldable tree")),
-                ("boxes", _("Boxes")),
-                ("boxes-omit-root", _("Boxes (omit root)")),
-                ("bottom-up", _("Table: bottom up")),
-                ("top-down", _("Table: top down")),
-            ],
-        )
+        return _aggr_tree_type_valuespec()
+
+
+@request_memoize()
+def _aggr_tree_type_valuespec() -> DropdownChoice[str]:
+    return DropdownChoice(
+        title=_("Type of tree layout"),
+        default_value="foldable",
+        choices=[
+            ("foldable", _("Foldable tree")),
+            ("boxes", _("Boxes")),
+            ("boxes-omit-root", _("Boxes (omit root)")),
+            ("bottom-up", _("Table: bottom up")),
+            ("top-down", _("Table: top down")),
+        ],
+    )
 
 
 class PainterOptionAggrWrap(PainterOption):
@@ -1652,14 +1821,19 @@ class PainterOptionAggrWrap(PainterOption):
 
     @property
     def valuespec(self) -> ValueSpec:
-        return DropdownChoice(
-            title=_("Handling of too long texts (affects only table)"),
-            default_value="wrap",
-            choices=[
-                ("wrap", _("wrap")),
-                ("nowrap", _("don't wrap")),
-            ],
-        )
+        return _aggr_wrap_valuespec()
+
+
+@request_memoize()
+def _aggr_wrap_valuespec() -> DropdownChoice[str]:
+    return DropdownChoice(
+        title=_("Handling of too long texts (affects only table)"),
+        default_value="wrap",
+        choices=[
+            ("wrap", _("wrap")),
+            ("nowrap", _("don't wrap")),
+        ],
+    )
 
 
 def paint_aggregated_tree_state(
@@ -1684,15 +1858,38 @@ def paint_aggregated_tree_state(
     else:
         raise NotImplementedError()
 
+    omit_root = treetype == "boxes-omit-root"
+
+    # Group headers are rendered twice by the layouts and the rows of the single host
+    # aggregations share the tree of the aggregation, render each of them only once
+    tree_row = (row["aggr_treestate"], row["aggr_tree"], row["aggr_hosts"], row["aggr_group"])
+    key = (id(tree_row[0]), cls, omit_root, expansion_level, only_problems, wrap_texts)
+    rendered_trees = _rendered_aggregated_trees()
+    if (cached := rendered_trees.get(key)) is not None and _is_same_tree_row(cached[0], tree_row):
+        return cached[1]
+
     renderer = cls(
         row,
-        omit_root=(treetype == "boxes-omit-root"),
+        omit_root=omit_root,
         expansion_level=expansion_level,
         only_problems=only_problems,
         lazy=True,
         wrap_texts=wrap_texts,
     )
-    return renderer.css_class(), renderer.render()
+    cell_spec = renderer.css_class(), renderer.render()
+    rendered_trees[key] = (tree_row, cell_spec)
+    return cell_spec
+
+
+@request_memoize()
+def _rendered_aggregated_trees() -> dict[tuple, tuple[tuple, CellSpec]]:
+    # The rows are kept together with their rendered tree, so their id() is not reused during a
+    # request
+    return {}
+
+
+def _is_same_tree_row(cached: tuple, tree_row: tuple) -> bool:
+    return all(a is b for a, b in zip(cached[:3], tree_row[:3])) and cached[3] == tree_row[3]
 
 
 class PainterAggrTreestate(Painter):
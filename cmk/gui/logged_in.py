@@ -12,6 +12,7 @@ import logging
 import os
 import time
 from collections.abc import Container, Iterator
+from pathlib import Path
 from typing import Any, ContextManager, Final
 
 from livestatus import SiteConfigurations, SiteId
@@ -85,7 +86,7 @@ class LoggedInUser:
     def _load_attributes(self, user_id: UserId | None, role_ids: list[str]) -> Any:
         if user_id is None:
             return {"roles": role_ids}
-        attributes = self.load_file("cached_profile", None)
+        attributes = self._load_cached_profile()
         if attributes is None:
             attributes = active_config.multisite_users.get(
                 user_id,
@@ -95,6 +96,19 @@ class LoggedInUser:
             )
         return attributes
 
+    def _load_cached_profile(self) -> Any:
+        if self.confdir is None:
+            return None
+
+        # The profile is needed on every request but only changes when the users are saved, so
+        # use the pickled version instead of parsing the file every time.
+        try:
+            return store.try_load_file_from_pickle_cache(
+                Path(self.confdir, "cached_profile.mk"), default=None
+            )
+        except (ValueError, SyntaxError):
+            return None
+
     def get_attribute(self, key: str, deflt: Any = None) -> Any:
         return self._attributes.get(key, deflt)
 
@@ -8,6 +8,8 @@ from __future__ import annotations
 
 import ast
 import copy
+import functools
+import heapq
 import os
 import shutil
 import time
@@ -16,12 +18,11 @@ from collections.abc import Callable, Iterable, Mapping
 from contextlib import suppress
 from dataclasses import asdict, dataclass
 from datetime import datetime, timedelta
-from logging import Logger
+from logging import DEBUG, Logger
+from multiprocessing.pool import ThreadPool
 from pathlib import Path
 from typing import Any, Literal, TypeVar
 
-from six import ensure_str
-
 import cmk.utils.paths
 import cmk.utils.store as store
 import cmk.utils.version as cmk_version
@@ -186,8 +187,8 @@ def user_exists(username: UserId) -> bool:
 
 
 def _user_exists_according_to_profile(username: UserId) -> bool:
-    base_path = cmk.utils.paths.profile_dir / username
-    return base_path.joinpath("transids.mk").exists() or base_path.joinpath("serial.mk").exists()
+    base_path = f"{cmk.utils.paths.profile_dir}/{username}/"
+    return os.path.exists(base_path + "transids.mk") or os.path.exists(base_path + "serial.mk")
 
 
 def _check_login_timeout(username: UserId, idle_time: float) -> None:
@@ -223,10 +224,10 @@ def need_to_change_pw(username: UserId, now: datetime) -> str | None:
         return None
     if load_custom_attr(user_id=username, key="enforce_pw_change", parser=utils.saveint) == 1:
         return "enforced"
-    last_pw_change = load_custom_attr(user_id=username, key="last_pw_change", parser=utils.saveint)
     max_pw_age = active_config.password_policy.get("max_age")
     if not max_pw_age:
         return None
+    last_pw_change = load_custom_attr(user_id=username, key="last_pw_change", parser=utils.saveint)
     if not last_pw_change:
         # The age of the password is unknown. Assume the user has just set
         # the password to have the first access after enabling password aging
@@ -275,10 +276,16 @@ def make_two_factor_backup_codes() -> list[tuple[str, str]]:
 
     The codes are returned in plain form for displaying and in hashed+salted form for storage
     """
-    return [
-        (password, password_hashing.hash_password(Password(password)))
-        for password in (utils.get_random_string(10) for i in range(10))
-    ]
+    passwords = [utils.get_random_string(10) for i in range(10)]
+    # Hashing is what takes the time here. bcrypt releases the GIL while doing it, so the codes
+    # can be hashed on all CPUs in parallel.
+    with ThreadPool(min(len(passwords), os.cpu_count() or 1)) as pool:
+        pw_hashes = pool.map(_hash_backup_code, passwords)
+    return list(zip(passwords, pw_hashes))
+
+
+def _hash_backup_code(password: str) -> str:
+    return password_hashing.hash_password(Password(password))
 
 
 def is_two_factor_backup_code_valid(user_id: UserId, code: str) -> bool:
@@ -364,14 +371,8 @@ class UserSelection(DropdownChoice[UserId]):
         self, none_value: str | None, only_contacts: bool = False, only_automation: bool = False
     ):
         def get_wato_users(nv: str | None) -> list[tuple[UserId | None, str]]:
-            users = load_users()
-            elements: list[tuple[UserId | None, str]] = sorted(
-                [
-                    (name, "{} - {}".format(name, us.get("alias", name)))
-                    for (name, us) in users.items()
-                    if (not only_contacts or us.get("contactgroups"))
-                    and (not only_automation or us.get("automation_secret"))
-                ]
+            elements: list[tuple[UserId | None, str]] = list(
+                _wato_user_choices(only_contacts, only_automation)
             )
             if nv is not None:
                 elements.insert(0, (None, nv))
@@ -383,6 +384,19 @@ class UserSelection(DropdownChoice[UserId]):
         return str(super().value_to_html(value)).rsplit(" - ", 1)[-1]
 
 
+# The choices are computed again for every value shown by a dropdown, e.g. once per table row
+@request_memoize()
+def _wato_user_choices(only_contacts: bool, only_automation: bool) -> list[tuple[UserId, str]]:
+    return sorted(
+        [
+            (name, "{} - {}".format(name, us.get("alias", name)))
+            for (name, us) in load_users().items()
+            if (not only_contacts or us.get("contactgroups"))
+            and (not only_automation or us.get("automation_secret"))
+        ]
+    )
+
+
 def on_succeeded_login(username: UserId, now: datetime) -> str:
     _ensure_user_can_init_session(username, now)
     _reset_failed_logins(username)
@@ -559,10 +573,11 @@ def _cleanup_old_sessions(
         # reach this place, we can be sure that we are allowed to remove all existing ones.
         return {}
 
+    oldest_activity = now.timestamp() - 86400 * 7
     return {
         s.session_id: s
-        for s in sorted(session_infos.values(), key=lambda s: s.last_activity, reverse=True)[:20]
-        if now.timestamp() - s.last_activity < 86400 * 7
+        for s in heapq.nlargest(20, session_infos.values(), key=lambda s: s.last_activity)
+        if s.last_activity > oldest_activity
     }
 
 
@@ -608,13 +623,14 @@ def _convert_session_info(value: str) -> dict[str, SessionInfo]:
         return {k: SessionInfo(**v) for k, v in ast.literal_eval(value).items()}
 
     # Transform pre 2.0 values
-    session_id, last_activity = value.split("|", 1)
+    session_id, _sep, last_activity_str = value.partition("|")
+    last_activity = int(last_activity_str)
     return {
         session_id: SessionInfo(
             session_id=session_id,
             # We don't have that information. The best guess is to use the last activitiy
-            started_at=int(last_activity),
-            last_activity=int(last_activity),
+            started_at=last_activity,
+            last_activity=last_activity,
             flashes=[],
         ),
     }
@@ -710,17 +726,16 @@ def load_users(lock: bool = False) -> Users:  # pylint: disable=too-many-branche
     result = {}
     for uid, user in users.items():
         # Transform user IDs which were stored with a wrong type
-        uid = ensure_str(uid)  # pylint: disable= six-ensure-str-bin-call
+        if isinstance(uid, bytes):
+            uid = uid.decode("utf-8")
 
         profile = contacts.get(uid, {})
         profile.update(user)
         result[uid] = profile
 
         # Convert non unicode mail addresses
-        if "email" in profile:
-            profile["email"] = ensure_str(  # pylint: disable= six-ensure-str-bin-call
-                profile["email"]
-            )
+        if isinstance(email := profile.get("email"), bytes):
+            profile["email"] = email.decode("utf-8")
 
     # This loop is only neccessary if someone has edited
     # contacts.mk manually. But we want to support that as
@@ -740,8 +755,7 @@ def load_users(lock: bool = False) -> Users:  # pylint: disable=too-many-branche
     # they are getting according to the multisite old-style
     # configuration variables.
 
-    htpwd_entries = Htpasswd(Path(cmk.utils.paths.htpasswd_file)).load(allow_missing_file=True)
-    for uid, password in htpwd_entries.items():
+    for uid, password in _load_htpasswd_entries().items():
         if password.startswith("!"):
             locked = True
             password = password[1:]
@@ -769,13 +783,13 @@ def load_users(lock: bool = False) -> Users:  # pylint: disable=too-many-branche
     # Now read the serials, only process for existing users
     serials_file = Path(cmk.utils.paths.htpasswd_file).with_name("auth.serials")
     try:
-        for line in serials_file.read_text(encoding="utf-8").splitlines():
-            if ":" in line:
-                user_id, serial = line.split(":")[:2]
-                if user_id in result:
-                    result[user_id]["serial"] = utils.saveint(serial)
+        serials_text = serials_file.read_text(encoding="utf-8")
     except OSError:  # file not found
-        pass
+        serials_text = ""
+
+    serials = dict(line.split(":", 2)[:2] for line in serials_text.splitlines() if ":" in line)
+    for user_id in serials.keys() & result.keys():
+        result[user_id]["serial"] = utils.saveint(serials[user_id])
 
     attributes: list[tuple[str, Callable]] = [
         ("num_failed_logins", utils.saveint),
@@ -789,35 +803,44 @@ def load_users(lock: bool = False) -> Users:  # pylint: disable=too-many-branche
         ("ui_sidebar_position", lambda x: None if x == "None" else x),
     ]
 
-    # Now read the user specific files
-    directory = cmk.utils.paths.var_dir + "/web/"
-    for uid in os.listdir(directory):
-        if uid[0] != ".":
+    # Now read the user specific files. Only the directories are user profiles, there are some
+    # files placed next to them.
+    with os.scandir(cmk.utils.paths.var_dir + "/web/") as entries:
+        profile_dirs = [entry for entry in entries if entry.name[0] != "." and entry.is_dir()]
 
-            # read special values from own files
-            if uid in result:
-                for attr, conv_func in attributes:
-                    val = load_custom_attr(user_id=uid, key=attr, parser=conv_func)
-                    if val is not None:
-                        result[uid][attr] = val
+    profile_attr_cache: dict[str, tuple[int, int, Any]] = {}
+    for profile_dir in profile_dirs:
+        uid = profile_dir.name
 
-            # read automation secrets and add them to existing
-            # users or create new users automatically
-            try:
-                user_secret_path = Path(directory) / uid / "automation.secret"
-                with user_secret_path.open(encoding="utf-8") as f:
-                    secret: str | None = f.read().strip()
-            except OSError:
-                secret = None
+        # read special values from own files
+        if uid in result:
+            for attr, conv_func in attributes:
+                val = _load_profile_attr(
+                    f"{profile_dir.path}/{attr}.mk", conv_func, profile_attr_cache
+                )
+                if val is not None:
+                    result[uid][attr] = val
 
-            if secret:
-                if uid in result:
-                    result[uid]["automation_secret"] = secret
-                else:
-                    result[uid] = {
-                        "roles": ["guest"],
-                        "automation_secret": secret,
-                    }
+        # read automation secrets and add them to existing
+        # users or create new users automatically
+        try:
+            with open(f"{profile_dir.path}/automation.secret", encoding="utf-8") as f:
+                secret: str | None = f.read().strip()
+        except OSError:
+            secret = None
+
+        if secret:
+            if uid in result:
+                result[uid]["automation_secret"] = secret
+            else:
+                result[uid] = {
+                    "roles": ["guest"],
+                    "automation_secret": secret,
+                }
+
+    # Only keep what was loaded now, which drops the files of removed users
+    _profile_attr_cache.clear()
+    _profile_attr_cache.update(profile_attr_cache)
 
     return result
 
@@ -840,6 +863,67 @@ def load_custom_attr(
     return None if result == "" else parser(result.strip())
 
 
+# Parsed custom attributes of all users, kept between the requests handled by this process. They
+# are stored together with the modification time and size of their file.
+_profile_attr_cache: dict[str, tuple[int, int, Any]] = {}
+
+# The time stamps of the file systems may be too coarse to tell apart two modifications made
+# shortly after each other. Files modified more recently than this are not cached.
+_CACHED_FILE_MIN_AGE_NS = 2 * 10**9
+
+
+def _load_profile_attr(
+    path: str, parser: Callable[[str], T], profile_attr_cache: dict[str, tuple[int, int, Any]]
+) -> T | None:
+    """Load a custom attribute for load_users(), only reading the file in case it changed
+
+    The loaded entry is added to profile_attr_cache, which replaces the module cache afterwards.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    if (cached := _profile_attr_cache.get(path)) is not None and cached[:2] == (
+        stat.st_mtime_ns,
+        stat.st_size,
+    ):
+        value = cached[2]
+    else:
+        text = store.load_text_from_file(Path(path))
+        value = None if text == "" else parser(text.strip())
+
+    if time.time_ns() - stat.st_mtime_ns > _CACHED_FILE_MIN_AGE_NS:
+        profile_attr_cache[path] = (stat.st_mtime_ns, stat.st_size, value)
+
+    # The users are modified by the callers, hand out a copy of the cached value
+    return copy.deepcopy(value)
+
+
+# Parsed htpasswd files by path, kept between the requests handled by this process
+_htpasswd_cache: dict[Path, tuple[int, int, Mapping[UserId, str]]] = {}
+
+
+def _load_htpasswd_entries() -> Mapping[UserId, str]:
+    """Load the htpasswd file for load_users(), only parsing it in case it changed"""
+    path = Path(cmk.utils.paths.htpasswd_file)
+    try:
+        stat = path.stat()
+    except OSError:
+        return {}
+
+    if (cached := _htpasswd_cache.get(path)) is not None and cached[:2] == (
+        stat.st_mtime_ns,
+        stat.st_size,
+    ):
+        return cached[2]
+
+    entries = Htpasswd(path).load(allow_missing_file=True)
+    if time.time_ns() - stat.st_mtime_ns > _CACHED_FILE_MIN_AGE_NS:
+        _htpasswd_cache[path] = (stat.st_mtime_ns, stat.st_size, entries)
+    return entries
+
+
 def save_custom_attr(userid: UserId, key: str, val: Any) -> None:
     path = custom_attr_path(userid, key)
     store.mkdir(os.path.dirname(path))
@@ -858,16 +942,12 @@ def get_online_user_ids(now: datetime) -> list[UserId]:
     return [
         user_id
         for user_id, user in load_users(lock=False).items()
-        if get_last_activity(user) >= online_threshold
+        if any(s.last_activity >= online_threshold for s in user.get("session_info", {}).values())
     ]
 
 
 def get_last_activity(user: UserSpec) -> int:
-    return max([s.last_activity for s in user.get("session_info", {}).values()] + [0])
-
-
-def split_dict(d: Mapping[str, Any], keylist: list[str], positive: bool) -> dict[str, Any]:
-    return {k: v for k, v in d.items() if (k in keylist) == positive}
+    return max((s.last_activity for s in user.get("session_info", {}).values()), default=0)
 
 
 def save_users(profiles: Users, now: datetime) -> None:
@@ -890,6 +970,7 @@ def save_users(profiles: Users, now: datetime) -> None:
     # Invalidate the users memoized data
     # The magic attribute has been added by the lru_cache decorator.
     load_users.cache_clear()  # type: ignore[attr-defined]
+    _wato_user_choices.cache_clear()  # type: ignore[attr-defined]
 
     # Call the users_saved hook
     hooks.call("users-saved", updated_profiles)
@@ -898,18 +979,22 @@ def save_users(profiles: Users, now: datetime) -> None:
 # TODO: Isn't this needed only while generating the contacts.mk?
 #       Check this and move it to the right place
 def _add_custom_macro_attributes(profiles: Users) -> Users:
-    updated_profiles = copy.deepcopy(profiles)
-
     # Add custom macros
     core_custom_macros = {
         name for name, attr in get_user_attributes() if attr.add_custom_macro()  #
     }
-    for user in updated_profiles.keys():
-        for macro in core_custom_macros:
-            if macro in updated_profiles[user]:
+    if not core_custom_macros:
+        return profiles
+
+    # Only the users which get additional keys need their own copy, all others are shared
+    updated_profiles = dict(profiles)
+    for user_id, user in profiles.items():
+        if macros := core_custom_macros & user.keys():
+            updated_user = updated_profiles[user_id] = user.copy()
+            for macro in macros:
                 # UserSpec is now a TypedDict, unfortunately not complete yet,
                 # thanks to such constructs.
-                updated_profiles[user]["_" + macro] = updated_profiles[user][macro]  # type: ignore[literal-required]
+                updated_user["_" + macro] = updated_user[macro]  # type: ignore[literal-required]
 
     return updated_profiles
 
@@ -919,8 +1004,8 @@ def _save_user_profiles(  # pylint: disable=too-many-branches
     updated_profiles: Users,
     now: datetime,
 ) -> None:
-    non_contact_keys = _non_contact_keys()
-    multisite_keys = _multisite_keys()
+    non_contact_keys = frozenset(_non_contact_keys())
+    multisite_keys = frozenset(_multisite_keys())
 
     for user_id, user in updated_profiles.items():
         user_dir = cmk.utils.paths.var_dir + "/web/" + user_id
@@ -986,16 +1071,16 @@ def _cleanup_old_user_profiles(updated_profiles: Users) -> None:
         "transids.mk",
         "serial.mk",
     ]
-    directory = cmk.utils.paths.var_dir + "/web"
-    for user_dir in os.listdir(cmk.utils.paths.var_dir + "/web"):
-        if user_dir not in [".", ".."] and user_dir not in updated_profiles:
-            entry = directory + "/" + user_dir
-            if not os.path.isdir(entry):
+    with os.scandir(cmk.utils.paths.var_dir + "/web") as entries:
+        for entry in entries:
+            if entry.name in updated_profiles or not entry.is_dir():
                 continue
 
             for to_delete in profile_files_to_delete:
-                if os.path.exists(entry + "/" + to_delete):
-                    os.unlink(entry + "/" + to_delete)
+                try:
+                    os.unlink(entry.path + "/" + to_delete)
+                except FileNotFoundError:
+                    pass
 
 
 def write_contacts_and_users_file(
@@ -1012,40 +1097,29 @@ def write_contacts_and_users_file(
         check_mk_config_dir = "%s/conf.d/wato" % cmk.utils.paths.default_config_dir
         multisite_config_dir = "%s/multisite.d/wato" % cmk.utils.paths.default_config_dir
 
-    non_contact_attributes_cache: dict[str | None, list[str]] = {}
-    multisite_attributes_cache: dict[str | None, list[str]] = {}
+    # The keys to filter only depend on the connector of the user
+    non_contact_keys_by_connector: dict[str | None, frozenset[str]] = {}
+    multisite_keys_by_connector: dict[str | None, frozenset[str]] = {}
     for user_settings in updated_profiles.values():
         connector = user_settings.get("connector")
-        if connector not in non_contact_attributes_cache:
-            non_contact_attributes_cache[connector] = non_contact_attributes(connector)
-        if connector not in multisite_attributes_cache:
-            multisite_attributes_cache[connector] = multisite_attributes(connector)
-
-    # Remove multisite keys in contacts.
-    # TODO: Clean this up. Just improved the performance, but still have no idea what its actually doing...
-    contacts = dict(
-        e
-        for e in [
-            (
-                id,
-                split_dict(
-                    user,
-                    non_contact_keys + non_contact_attributes_cache[user.get("connector")],
-                    False,
-                ),
+        if connector not in non_contact_keys_by_connector:
+            non_contact_keys_by_connector[connector] = frozenset(
+                non_contact_keys + non_contact_attributes(connector)
+            )
+            multisite_keys_by_connector[connector] = frozenset(
+                multisite_keys + multisite_attributes(connector)
             )
-            for (id, user) in updated_profiles.items()
-        ]
-    )
 
+    # Remove multisite keys in contacts.
+    contacts = {}
     # Only allow explicitely defined attributes to be written to multisite config
     users = {}
     for uid, profile in updated_profiles.items():
-        users[uid] = {
-            p: val
-            for p, val in profile.items()
-            if p in multisite_keys + multisite_attributes_cache[profile.get("connector")]
-        }
+        connector = profile.get("connector")
+        contact_excluded_keys = non_contact_keys_by_connector[connector]
+        contacts[uid] = {p: val for p, val in profile.items() if p not in contact_excluded_keys}
+        multisite_included_keys = multisite_keys_by_connector[connector]
+        users[uid] = {p: val for p, val in profile.items() if p in multisite_included_keys}
 
     # Checkmk's monitoring contacts
     store.save_to_mk_file(
@@ -1101,18 +1175,31 @@ def _multisite_keys() -> list[str]:
 
 
 def _get_multisite_custom_variable_names() -> list[str]:
-    return [name for name, attr in get_user_attributes() if attr.domain() == "multisite"]  #
+    return list(_multisite_custom_variable_names(tuple(user_attribute_registry.items())))
+
+
+# The registered attribute classes are the cache key, so (un)registering attributes, e.g. when
+# the config based attributes are updated, invalidates the cached names.
+@functools.lru_cache(maxsize=1)
+def _multisite_custom_variable_names(
+    attributes: tuple[tuple[str, type[UserAttribute]], ...]
+) -> tuple[str, ...]:
+    return tuple(name for name, attr_class in attributes if attr_class().domain() == "multisite")
 
 
 def _save_auth_serials(updated_profiles: Users) -> None:
     """Write out the users serials"""
-    # Write out the users serials
-    serials = ""
-    for user_id, user in updated_profiles.items():
-        serials += "%s:%d\n" % (user_id, user.get("serial", 0))
-    store.save_text_to_file(
-        "%s/auth.serials" % os.path.dirname(cmk.utils.paths.htpasswd_file), serials
+    serials = "".join(
+        "%s:%d\n" % (user_id, user.get("serial", 0)) for user_id, user in updated_profiles.items()
     )
+    serials_file = Path(cmk.utils.paths.htpasswd_file).with_name("auth.serials")
+
+    # Most saves, e.g. during user syncs, do not change any serial
+    with suppress(OSError):
+        if serials_file.read_text(encoding="utf-8") == serials:
+            return
+
+    store.save_text_to_file(serials_file, serials)
 
 
 def rewrite_users(now: datetime) -> None:
@@ -1140,7 +1227,10 @@ def create_cmk_automation_user(now: datetime) -> None:
 
 
 def _save_cached_profile(
-    user_id: UserId, user: UserSpec, multisite_keys: list[str], non_contact_keys: list[str]
+    user_id: UserId,
+    user: UserSpec,
+    multisite_keys: frozenset[str],
+    non_contact_keys: frozenset[str],
 ) -> None:
     # Only save contact AND multisite attributes to the profile. Not the
     # infos that are stored in the custom attribute files.
@@ -1527,23 +1617,21 @@ def cleanup_abandoned_profiles(logger: Logger, now: datetime, max_age: timedelta
     # Some files like ldap_*_sync_time.mk can be placed in
     # ~/var/check_mk/web, causing error entries in web.log while trying to
     # delete a dir
-    profiles = {
-        profile_dir.name for profile_dir in profile_base_dir.iterdir() if profile_dir.is_dir()
-    }
+    with os.scandir(profile_base_dir) as entries:
+        profiles = {entry.name for entry in entries if entry.is_dir()}
 
-    abandoned_profiles = sorted(profiles - users)
+    abandoned_profiles = profiles - users
     if not abandoned_profiles:
         logger.debug("Found no abandoned profile.")
         return
 
     logger.info("Found %d abandoned profiles", len(abandoned_profiles))
-    logger.debug("Profiles: %s", ", ".join(abandoned_profiles))
+    if logger.isEnabledFor(DEBUG):
+        logger.debug("Profiles: %s", ", ".join(sorted(abandoned_profiles)))
 
     for profile_name in abandoned_profiles:
         profile_dir = profile_base_dir / profile_name
-        last_mtime = datetime.fromtimestamp(
-            max((p.stat().st_mtime for p in profile_dir.glob("*.mk")), default=0.0)
-        )
+        last_mtime = datetime.fromtimestamp(_latest_mk_file_mtime(profile_dir))
         if now - last_mtime > max_age:
             try:
                 logger.info("Removing abandoned profile directory: %s", profile_name)
@@ -1552,6 +1640,15 @@ def cleanup_abandoned_profiles(logger: Logger, now: datetime, max_age: timedelta
                 logger.debug("Could not delete %s", profile_dir, exc_info=True)
 
 
+def _latest_mk_file_mtime(profile_dir: Path) -> float:
+    latest_mtime = 0.0
+    with os.scandir(profile_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(".mk"):
+                latest_mtime = max(latest_mtime, entry.stat().st_mtime)
+    return latest_mtime
+
+
 def _register_user_attributes() -> None:
     user_attribute_registry.register(user_attributes.ForceAuthUserUserAttribute)
     user_attribute_registry.register(user_attributes.DisableNotificationsUserAttribute)
@@ -8,8 +8,27 @@ from pathlib import Path
 from uuid import UUID
 
 from agent_receiver import site_context
-from agent_receiver.models import HostTypeEnum
-from agent_receiver.utils import Host, update_file_access_time
+from agent_receiver.models import HostTypeEnum, RegistrationStatusEnum
+from agent_receiver.utils import (
+    get_registration_status_from_file,
+    Host,
+    update_file_access_time,
+    uuid_from_pem_csr,
+)
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+
+def _generate_csr(name_attributes: list[x509.NameAttribute]) -> str:
+    return (
+        x509.CertificateSigningRequestBuilder()
+        .subject_name(x509.Name(name_attributes))
+        .sign(ec.generate_private_key(ec.SECP256R1()), hashes.SHA256())
+        .public_bytes(serialization.Encoding.PEM)
+        .decode("utf-8")
+    )
 
 
 def test_host_not_registered(uuid: UUID) -> None:
@@ -61,3 +80,63 @@ def test_update_file_access_time_success(tmp_path: Path) -> None:
 
 def test_update_file_access_time_no_file(tmp_path: Path) -> None:
     update_file_access_time(tmp_path / "my_file")
+
+
+def test_uuid_from_pem_csr(uuid: UUID) -> None:
+    assert uuid_from_pem_csr(
+        _generate_csr(
+            [
+                x509.NameAttribute(NameOID.ORGANIZATION_NAME, "Checkmk"),
+                x509.NameAttribute(NameOID.COMMON_NAME, str(uuid)),
+            ]
+        )
+    ) == str(uuid)
+
+
+def test_uuid_from_pem_csr_invalid() -> None:
+    assert uuid_from_pem_csr("not a csr") == "[CSR parsing failed]"
+
+
+def test_update_file_access_time_skips_recent_update(tmp_path: Path) -> None:
+    file_path = tmp_path / "my_file"
+    file_path.touch()
+
+    update_file_access_time(file_path)
+    first_access_time = file_path.stat().st_atime
+    time.sleep(0.01)
+    update_file_access_time(file_path)
+
+    assert file_path.stat().st_atime == first_access_time
+
+
+def test_host_iter_all(tmp_path: Path, uuid: UUID) -> None:
+    (site_context.agent_output_dir() / str(uuid)).symlink_to(tmp_path / "hostname")
+    (site_context.agent_output_dir() / "not-a-link").touch()
+
+    hosts = {host.source_path.name: host for host in Host.iter_all()}
+
+    assert hosts.keys() == {str(uuid), "not-a-link"}
+    assert hosts[str(uuid)].registered is True
+    assert hosts[str(uuid)].hostname == "hostname"
+    assert hosts[str(uuid)].host_type is HostTypeEnum.PULL
+    assert hosts["not-a-link"].registered is False
+    assert hosts["not-a-link"].hostname is None
+    assert hosts["not-a-link"].host_type is None
+
+
+def test_get_registration_status_from_file_after_status_change(uuid: UUID) -> None:
+    (path_new := site_context.r4r_dir() / "NEW").mkdir()
+    (path_ready := site_context.r4r_dir() / "READY").mkdir()
+    (path_new / f"{uuid}.json").touch()
+
+    assert (registration_data := get_registration_status_from_file(uuid))
+    assert registration_data.status is RegistrationStatusEnum.NEW
+
+    (path_new / f"{uuid}.json").rename(path_ready / f"{uuid}.json")
+
+    assert (registration_data := get_registration_status_from_file(uuid))
+    assert registration_data.status is RegistrationStatusEnum.READY
+
+
+def test_get_registration_status_from_file_missing(uuid: UUID) -> None:
+    assert get_registration_status_from_file(uuid) is None
@@ -127,12 +127,11 @@ def test__get_metrics() -> None:
     metrics_data = [
         ['{"name": "cpu_percent", "aggregation": "average", "value": 0.0, "unit": "percent"}']
     ]
-    assert list(_get_metrics(metrics_data)) == [
-        (
-            "average_cpu_percent",
-            AzureMetric(name="cpu_percent", aggregation="average", value=0.0, unit="percent"),
-        )
-    ]
+    assert _get_metrics(metrics_data) == {
+        "average_cpu_percent": AzureMetric(
+            name="cpu_percent", aggregation="average", value=0.0, unit="percent"
+        ),
+    }
 
 
 @pytest.mark.parametrize(
@@ -474,6 +474,115 @@ def test_get_last_activity(with_user: tuple[UserId, str]) -> None:
     assert userdb.get_last_activity(user) == int(now.timestamp())
 
 
+def _set_custom_attr_mtime(user_id: UserId, key: str, timestamp: float) -> None:
+    os.utime(userdb.custom_attr_path(user_id, key), (timestamp, timestamp))
+
+
+def test_load_users_reuses_unchanged_custom_attrs(user_id: UserId) -> None:
+    timestamp = (datetime.now() - timedelta(minutes=1)).timestamp()
+    userdb.save_custom_attr(user_id, "num_failed_logins", "3")
+    _set_custom_attr_mtime(user_id, "num_failed_logins", timestamp)
+    assert _load_users_uncached(lock=False)[user_id]["num_failed_logins"] == 3
+
+    # Same size and modification time: The file is not read again
+    userdb.save_custom_attr(user_id, "num_failed_logins", "4")
+    _set_custom_attr_mtime(user_id, "num_failed_logins", timestamp)
+    assert _load_users_uncached(lock=False)[user_id]["num_failed_logins"] == 3
+
+    userdb.save_custom_attr(user_id, "num_failed_logins", "5")
+    assert _load_users_uncached(lock=False)[user_id]["num_failed_logins"] == 5
+
+
+def test_load_users_hands_out_copies_of_cached_custom_attrs(user_id: UserId) -> None:
+    now = datetime.now()
+    make_valid_session(user_id, now)
+    _set_custom_attr_mtime(user_id, "session_info", (now - timedelta(minutes=1)).timestamp())
+
+    _load_users_uncached(lock=False)[user_id]["session_info"].clear()
+
+    assert "sess2" in _load_users_uncached(lock=False)[user_id]["session_info"]
+
+
+def test_load_users_reuses_unchanged_htpasswd(user_id: UserId, monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.setattr(userdb, "_htpasswd_cache", {})
+    htpasswd_file = Path(cmk.utils.paths.htpasswd_file)
+    htpasswd_store = htpasswd.Htpasswd(htpasswd_file)
+    timestamp = (datetime.now() - timedelta(minutes=1)).timestamp()
+
+    htpasswd_store.save(user_id, "hash1")
+    os.utime(htpasswd_file, (timestamp, timestamp))
+    assert _load_users_uncached(lock=False)[user_id]["password"] == "hash1"
+
+    # Same size and modification time: The file is not parsed again
+    htpasswd_store.save(user_id, "hash2")
+    os.utime(htpasswd_file, (timestamp, timestamp))
+    assert _load_users_uncached(lock=False)[user_id]["password"] == "hash1"
+
+    htpasswd_store.save(user_id, "hash3")
+    assert _load_users_uncached(lock=False)[user_id]["password"] == "hash3"
+
+
+def test_save_users_keeps_unchanged_auth_serials(user_id: UserId) -> None:
+    serials_file = Path(cmk.utils.paths.htpasswd_file).with_name("auth.serials")
+    users = _load_users_uncached(lock=False)
+    userdb._save_auth_serials(users)
+    os.utime(serials_file, (0, 0))
+
+    userdb._save_auth_serials(users)
+    assert serials_file.stat().st_mtime == 0
+
+    users[user_id]["serial"] = 42
+    userdb._save_auth_serials(users)
+    assert f"{user_id}:42\n" in serials_file.read_text()
+    assert serials_file.stat().st_mtime != 0
+
+
+@pytest.mark.usefixtures("request_context")
+def test_user_selection_choices(user_id: UserId) -> None:
+    choices = userdb.UserSelection(none="None").choices()
+    assert choices[0] == (None, "None")
+    assert user_id in [choice_id for choice_id, _title in choices]
+
+    # Each dropdown gets its own list of the memoized choices
+    choices.clear()
+    assert user_id in [choice_id for choice_id, _title in userdb.UserSelection().choices()]
+
+
+def test_add_custom_macro_attributes(monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.setattr(
+        active_config,
+        "wato_user_attrs",
+        [
+            {
+                "add_custom_macro": True,
+                "help": "VIP attribute",
+                "name": "vip",
+                "show_in_table": False,
+                "title": "VIP",
+                "topic": "ident",
+                "type": "TextAscii",
+                "user_editable": True,
+            }
+        ],
+    )
+    monkeypatch.setattr(utils, "user_attribute_registry", utils.UserAttributeRegistry())
+    monkeypatch.setattr(userdb, "user_attribute_registry", utils.user_attribute_registry)
+    monkeypatch.setattr(ldap, "ldap_attribute_plugin_registry", ldap.LDAPAttributePluginRegistry())
+    userdb.update_config_based_user_attributes()
+
+    profiles: userdb.Users = {
+        UserId("vip"): {"alias": "VIP", "vip": "yes"},  # type: ignore[typeddict-item]
+        UserId("other"): {"alias": "Other"},
+    }
+    updated_profiles = userdb._add_custom_macro_attributes(profiles)
+
+    assert updated_profiles == {
+        UserId("vip"): {"alias": "VIP", "vip": "yes", "_vip": "yes"},
+        UserId("other"): {"alias": "Other"},
+    }
+    assert "_vip" not in profiles[UserId("vip")]
+
+
 def test_user_attribute_sync_plugins(
     request_context: None, monkeypatch: MonkeyPatch, set_config: SetConfig
 ) -> None: